@@ -0,0 +1,63 @@
+'''
+    Benchmark of the evaluation normalization (Evaluations.load_answers + build_tables) with
+    synthetic payloads, no API calls are made. The time per evaluation should stay flat from
+    1k to 100k evaluations, as rows are gathered in buffers and each dataframe is built once.
+
+    Run from the repository root:
+        python -m benchmarks.bench_buffers
+'''
+
+# Internal references
+from modules.api_evaluations import Evaluations
+
+# External libraries
+from types import SimpleNamespace
+import datetime as dt
+import sys
+
+SIZES = [1_000, 10_000, 100_000]
+
+class SyntheticConnection():
+    '''
+        Stands in for ApiConnection, answers every URL with a generated payload.
+    '''
+    url = 'http://localhost/api/rest'
+
+    def get(self, url: str):
+        evaluation = int(url.split('/eval/')[1].split('/')[0])
+
+        if url.endswith('/comment'):
+            return [{'$ref': f'{url}/{evaluation}', 'created': 1609459200000, 'text': 'Comment'}]
+
+        return {
+            'id': evaluation, 'score': 90, 'form': {'id': 1, 'name': 'Form'},
+            'sections': [
+                {'id': section, 'name': f'Section {section}', 'score': 1,
+                 'questions': [{'id': question, 'text': f'Question {question}', 'answer': {'score': 1}}
+                               for question in range(3)]}
+                for section in range(2)]
+        }
+
+def run(size: int) -> tuple[float, float]:
+    '''
+        Returns the seconds spent loading the answers (payloads included) and building the tables.
+    '''
+    evaluations = Evaluations(SimpleNamespace(batch_size=1000), SyntheticConnection())
+
+    start_time = dt.datetime.now()
+    for evaluation in range(size):
+        evaluations.load_answers(evaluation, evaluation)
+
+    build_time = dt.datetime.now()
+    evaluations.build_tables()
+    end_time = dt.datetime.now()
+
+    return (build_time - start_time).total_seconds(), (end_time - build_time).total_seconds()
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+
+    print(f'{"evaluations":>12} {"load s":>8} {"build s":>8} {"us/evaluation":>14}')
+    for size in sizes:
+        load, build = run(size)
+        print(f'{size:>12} {load:>8.2f} {build:>8.2f} {(load + build) / size * 1e6:>14.1f}')
@@ -0,0 +1,83 @@
+'''
+    Round trip of the database sink against SQLite (or any supported URL given as second argument).
+    Exports a synthetic table, checks the declared type of every column, then exports it again with
+    part of the rows changed and new ones added, and checks they were upserted on the natural key.
+
+    Run from the repository root:
+        python -m benchmarks.bench_database                       (100k rows)
+        python -m benchmarks.bench_database 1000000 sqlite:///bench.db
+'''
+
+# Internal references
+from modules.sinks import DatabaseSink
+
+# External libraries
+import logging, os, sys, tempfile, time
+import numpy as np
+import pandas as pd
+
+# Declared type expected in SQLite for every column of the synthetic table
+SQLITE_TYPES = {
+    'recordId':     'INTEGER',
+    'startTime':    'TEXT',
+    'agent.name':   'TEXT',
+    'holdTime':     'INTEGER',
+    'score':        'REAL',
+    'tags':         'TEXT',
+}
+
+def synthetic_table(rows: int, start: int = 0, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'recordId':     pd.array(np.arange(start, start + rows), dtype='Int64'),
+        'startTime':    pd.to_datetime(1_609_459_200_000 + np.arange(rows) * 1000, unit='ms'),
+        'agent.name':   pd.Categorical(rng.choice(['Agent 1', 'Agent 2', 'Agent 3'], rows)),
+        'holdTime':     rng.integers(0, 90, rows),
+        'score':        rng.random(rows) * 100,
+        'tags':         [['tag', int(value)] for value in rng.integers(0, 10, rows)],
+    })
+
+def run(rows: int, url: str) -> None:
+    sink    = DatabaseSink(url)
+    first   = synthetic_table(rows)
+
+    start_time = time.perf_counter()
+    sink.export(first, 'df_all_records')
+    print(f'export 1: {rows} rows in {time.perf_counter() - start_time:.2f} s')
+
+    if sink.dialect == 'sqlite':
+        declared = {row[1]: row[2] for row in sink.connection.execute('PRAGMA table_info("df_all_records")')}
+        assert declared == SQLITE_TYPES, f'declared types {declared} differ from {SQLITE_TYPES}'
+        print('column types match')
+
+    # The second half of the rows changes, as many new rows are added
+    second = synthetic_table(rows, start=rows // 2, seed=1)
+
+    start_time = time.perf_counter()
+    sink.export(second, 'df_all_records')
+    print(f'export 2: {rows} rows in {time.perf_counter() - start_time:.2f} s')
+
+    cursor  = sink.connection.cursor()
+    cursor.execute('SELECT COUNT(*), COUNT(DISTINCT "recordId") FROM "df_all_records"')
+    count, distinct = cursor.fetchone()
+    assert count == distinct == rows + rows // 2, f'{count} rows ({distinct} distinct) instead of {rows + rows // 2}'
+
+    record = int(second['recordId'].iloc[0])
+    cursor.execute('SELECT "score", "holdTime" FROM "df_all_records" WHERE "recordId" = ' + str(record))
+    score, hold_time = cursor.fetchone()
+    assert (score, hold_time) == (second['score'].iloc[0], second['holdTime'].iloc[0]), 'row was not updated'
+    assert isinstance(hold_time, int) and isinstance(score, float)
+    cursor.close()
+
+    sink.close()
+    print('rows upserted on the natural key')
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    if len(sys.argv) > 2:
+        run(rows, sys.argv[2])
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            run(rows, f'sqlite:///{os.path.join(folder, "bench.db")}')
@@ -0,0 +1,42 @@
+'''
+    Benchmark of the contact search decoding: stdlib json + json_normalize against modules.decoding,
+    both orjson + columnar flattening (records_frame) and pyarrow's JSON reader (decode_records, used
+    for the contact search), on synthetic contacts from the mock server.
+
+    Run from the repository root:
+        python -m benchmarks.bench_decoding                       (10k, 100k and 500k contacts)
+'''
+
+# Internal references
+from benchmarks.mock_server import MockCalabrio
+from modules.decoding import decode_records, loads, records_frame
+from modules.schemas import SCHEMAS
+
+# External libraries
+import json, sys, time
+import pandas as pd
+
+SIZES = [10_000, 100_000, 500_000]
+
+def timed(method, *args) -> float:
+    start_time = time.perf_counter()
+    method(*args)
+    return time.perf_counter() - start_time
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    schema = {'id': 'integer', **SCHEMAS['df_all_records']}
+
+    print(f'{"contacts":>10} {"MB":>8} {"json_normalize s":>17} {"columnar s":>11} {"speed-up":>9} '
+          f'{"pyarrow s":>10} {"speed-up":>9}')
+    for size in sizes:
+        mock = MockCalabrio(size, size // 10)
+        mock.server.server_close()
+        body = json.dumps([mock.contact(record) for record in range(size)]).encode('utf-8')
+
+        baseline = timed(lambda: pd.json_normalize(json.loads(body)))
+        columnar = timed(lambda: records_frame(loads(body), schema))
+        arrow    = timed(lambda: decode_records(body, schema))
+
+        print(f'{size:>10} {len(body) / 1024**2:>8.1f} {baseline:>17.2f} {columnar:>11.2f} {baseline / columnar:>8.1f}x '
+              f'{arrow:>10.2f} {baseline / arrow:>8.1f}x')
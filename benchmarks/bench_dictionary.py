@@ -0,0 +1,77 @@
+'''
+    Memory and Parquet size of a synthetic window (contacts, evaluations and their answers from the
+    mock server generators), with the repeated strings as dictionary columns (pandas categoricals, as
+    declared in modules.schemas) against plain Python strings.
+
+    Run from the repository root:
+        python -m benchmarks.bench_dictionary                     (20k evaluations, 200k contacts)
+        python -m benchmarks.bench_dictionary 50000
+'''
+
+# Internal references
+from benchmarks.mock_server import MockCalabrio
+from modules.api_evaluations import Evaluations
+from modules.decoding import records_frame
+from modules.parquet_writer import ParquetStreamWriter
+from modules.schemas import SCHEMAS, apply_schema
+
+# External libraries
+from types import SimpleNamespace
+import os, sys, tempfile
+import pandas as pd
+
+class MockConnection():
+    '''
+        Answers the evaluation URLs with the payloads of the mock server, without serving them.
+    '''
+    def __init__(self, mock: MockCalabrio) -> None:
+        self.mock   = mock
+        self.url    = mock.url
+
+    def get(self, url: str):
+        evaluation = int(url.split('/eval/')[1].split('/')[0])
+        return self.mock.comments(evaluation) if url.endswith('/comment') else self.mock.evaluation(evaluation)
+
+def synthetic_window(evaluations: int) -> dict[str, pd.DataFrame]:
+    mock = MockCalabrio(evaluations * 10, evaluations)
+    mock.server.server_close()
+
+    contacts    = [mock.contact(record) for record in range(mock.contacts)]
+    df_records  = records_frame(contacts, {'id': 'integer', **SCHEMAS['df_all_records']}).rename(columns={'id': 'recordId'})
+
+    loader = Evaluations(SimpleNamespace(batch_size=evaluations), MockConnection(mock))
+    for record in range(evaluations):
+        loader.load_answers(record, 1_000_000 + record)
+    loader.build_tables()
+
+    return {
+        'df_all_records':       apply_schema(df_records, 'df_all_records'),
+        'df_eval_details':      loader.df_eval_details,
+        'df_eval_sections':     loader.df_eval_sections,
+        'df_eval_questions':    loader.df_eval_questions,
+    }
+
+def as_strings(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype({name: object for name, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+
+def parquet_size(df: pd.DataFrame) -> int:
+    with tempfile.TemporaryDirectory() as folder:
+        with ParquetStreamWriter(folder) as writer:
+            writer.write(df)
+        return sum(os.path.getsize(file) for file in writer.files)
+
+if __name__ == '__main__':
+    evaluations = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    tables      = synthetic_window(evaluations)
+
+    print(f'{"table":<20} {"rows":>9} {"strings MB":>11} {"dictionary MB":>14} {"strings file MB":>16} {"dictionary file MB":>19}')
+    totals = [0, 0, 0, 0]
+    for name, df in tables.items():
+        strings = as_strings(df)
+        sizes   = [strings.memory_usage(deep=True).sum(), df.memory_usage(deep=True).sum(),
+                   parquet_size(strings), parquet_size(df)]
+        totals  = [total + size for total, size in zip(totals, sizes)]
+
+        print(f'{name:<20} {len(df):>9} ' + ' '.join(f'{size / 1024**2:>{width}.2f}' for size, width in zip(sizes, (11, 14, 16, 19))))
+
+    print(f'{"total":<20} {"":>9} ' + ' '.join(f'{size / 1024**2:>{width}.2f}' for size, width in zip(totals, (11, 14, 16, 19))))
@@ -0,0 +1,93 @@
+'''
+    Benchmark of the object store sink against a local S3 stand-in (moto's server, pip install "moto[server]"),
+    or any S3 compatible endpoint given as second argument (e.g. MinIO: http://localhost:9000).
+    Exports a synthetic table twice, checks its files were uploaded as they were completed, that the
+    manifest lists exactly the uploaded objects and that the objects of the first export were replaced.
+
+    Run from the repository root:
+        python -m benchmarks.bench_object_store                   (1M rows)
+        python -m benchmarks.bench_object_store 5000000 http://localhost:9000
+'''
+
+# Internal references
+from modules.sinks import ObjectStoreSink
+
+# External libraries
+from types import SimpleNamespace
+import datetime as dt
+import logging, os, sys, tempfile, time
+import boto3
+import numpy as np
+import pandas as pd
+
+def synthetic_table(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'recordId':     np.arange(rows, dtype='int64'),
+        'agentId':      rng.integers(0, 500, rows),
+        'score':        rng.random(rows) * 100,
+        'queue':        rng.choice(['Sales', 'Support', 'Billing', 'Retention'], rows),
+        'comment':      [f'comment {value}' for value in rng.integers(0, 1_000_000, rows)],
+    })
+
+def run(rows: int, endpoint_url: str) -> None:
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    boto3.client('s3', endpoint_url=endpoint_url).create_bucket(Bucket='calabrio-bench')
+
+    configuration = SimpleNamespace(
+        bucket_name = 'calabrio-bench', path = 'qm/calabrio', endpoint_url = endpoint_url,
+        staging_folder = tempfile.mkdtemp(), upload_workers = 8, upload_queue = 16,
+        multipart_threshold = 8 * 1024**2, multipart_chunksize = 8 * 1024**2, multipart_concurrency = 4,
+        compression = 'zstd', compression_level = 3, target_file_size = 16 * 1024**2, row_group_size = 100_000,
+        max_file_rows = rows // 4, cache_mode = 'off')
+
+    data = synthetic_table(rows)
+
+    for attempt in range(2):
+        sink = ObjectStoreSink(configuration)
+        sink.run_id = f'{sink.run_id}-{attempt}'
+
+        start_time = time.perf_counter()
+
+        # Written in batches, as the export pipeline does. Without an event date column, the table is
+        # a single partition (the window start)
+        writer = sink.open_writer('df_bench', dt.date(2022, 1, 1))
+        for start in range(0, rows, rows // 8):
+            writer.write(data.iloc[start:start + rows // 8])
+        queued = sum(len(partition.uploads) for partition in writer.writers.values())
+
+        manifest,  = [future.result() for future in sink.close_writer('df_bench', writer)]
+        elapsed    = time.perf_counter() - start_time
+        sink.close()
+
+        print(f'export {attempt + 1}: {rows} rows, {len(manifest["files"])} file(s), '
+              f'{manifest["bytes"] / 1024**2:.1f} MB in {elapsed:.2f} s, {queued} uploading before the writer closed')
+        assert queued >= len(manifest['files']) - 1, 'files were not uploaded as they were completed'
+
+    prefix  = sink.partition_key('df_bench', dt.date(2022, 1, 1))
+    listing = sink.client.list_objects_v2(Bucket='calabrio-bench', Prefix=prefix)
+    stored  = {item['Key'] for item in listing.get('Contents', list())} - {f'{prefix}/_manifest.json'}
+    listed  = {file['key'] for file in manifest['files']}
+
+    assert stored == listed, f'objects in the store {sorted(stored)} differ from the manifest {sorted(listed)}'
+    assert manifest['rows'] == rows
+    print('manifest matches the stored objects')
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    if len(sys.argv) > 2:
+        run(rows, sys.argv[2])
+    else:
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = ThreadedMotoServer(port=5055, verbose=False)
+        server.start()
+        try:
+            run(rows, 'http://localhost:5055')
+        finally:
+            server.stop()
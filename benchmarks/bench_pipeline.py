@@ -0,0 +1,126 @@
+'''
+    End-to-end benchmark of one extraction window (ApiCaller.load_data + export_data) against the
+    local mock server. For each scale it reports wall time, requests per second, peak RSS of the
+    extraction and bytes written.
+
+    Every scale runs the extraction in its own process, with a temporary config.yaml, state and
+    output folder, while the mock server runs in this process.
+
+    Run from the repository root:
+        python -m benchmarks.bench_pipeline                       (1k, 10k and 100k evaluations)
+        python -m benchmarks.bench_pipeline 1000 --latency 0.05 --error-rate 0.01
+'''
+
+# Internal references
+from benchmarks.mock_server import MockCalabrio
+
+# External libraries
+import argparse, datetime as dt, json, os, subprocess, sys, tempfile, time
+
+ROOT        = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZES       = [1_000, 10_000, 100_000]
+
+CONFIG = '''general:
+  bucket:
+  start_date: '2021-01-01'
+  log_file: calabrio_extract.log
+  state_file: calabrio_state.db
+  checkpoint_file: calabrio_checkpoint.json
+  parallel_windows: 1
+  path: qm/calabrio
+  token: token.bin
+api:
+  url: {url}
+  user: benchmark
+  pool_size: {concurrency}
+  concurrency: {concurrency}
+  page_size: 5000
+  workers: 16
+  request_budget: {concurrency}
+  rate_limit: 100000
+  min_rate: 100
+  max_rate: 100000
+  timeout: 60
+  max_retries: 5
+export:
+  compression: zstd
+  compression_level: 3
+  row_group_size: 100000
+  target_file_size_mb: 128
+session:
+  cookie:
+'''
+
+def extract() -> None:
+    '''
+        Runs one window in the current folder and prints the peak RSS, called in the child process.
+    '''
+    import resource
+    from modules.api_caller import ApiCaller
+
+    caller = ApiCaller(dt.date(2021, 1, 1), dt.date(2021, 2, 1))
+    caller.load_data()
+    caller.export_data()
+
+    # ru_maxrss is in kilobytes on Linux
+    print(json.dumps({'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+
+def output_bytes(folder: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name))
+               for path, _, names in os.walk(folder) for name in names)
+
+def run(evaluations: int, contacts_ratio: int, latency: float, error_rate: float, concurrency: int) -> dict:
+    from cryptography.fernet import Fernet
+
+    with MockCalabrio(evaluations * contacts_ratio, evaluations, latency=latency, error_rate=error_rate) as mock, \
+            tempfile.TemporaryDirectory() as folder:
+
+        key = Fernet.generate_key()
+        with open(os.path.join(folder, 'token.bin'), 'wb') as f:
+            f.write(Fernet(key).encrypt(b'benchmark'))
+        with open(os.path.join(folder, 'config.yaml'), 'w') as f:
+            f.write(CONFIG.format(url=mock.url, concurrency=concurrency))
+
+        env = dict(os.environ, py_key=key.decode(), PYTHONPATH=ROOT)
+
+        start_time  = time.perf_counter()
+        child       = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pipeline', '--extract'],
+                                     cwd=folder, env=env, capture_output=True, text=True, check=True)
+        elapsed     = time.perf_counter() - start_time
+
+        return {
+            'evaluations':  evaluations,
+            'seconds':      elapsed,
+            'requests':     mock.requests,
+            'rps':          mock.requests / elapsed,
+            'peak_rss':     json.loads(child.stdout.strip().splitlines()[-1])['peak_rss'],
+            'output_bytes': output_bytes(os.path.join(folder, 'output')),
+        }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end benchmark against the mock Calabrio API')
+    parser.add_argument('sizes',            type=int,   nargs='*', default=SIZES, help='Evaluations per window')
+    parser.add_argument('--contacts-ratio', type=int,   default=10, help='Contacts per evaluation')
+    parser.add_argument('--latency',        type=float, default=0)
+    parser.add_argument('--error-rate',     type=float, default=0)
+    parser.add_argument('--concurrency',    type=int,   default=32)
+    parser.add_argument('--json',           action='store_true', help='Print the results as JSON lines')
+    parser.add_argument('--extract',        action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.extract:
+        sys.path.insert(0, os.getcwd())
+        extract()
+        sys.exit()
+
+    if not args.json:
+        print(f'{"evaluations":>12} {"seconds":>9} {"requests":>9} {"req/s":>8} {"peak RSS MB":>12} {"output MB":>10}')
+
+    for size in args.sizes:
+        result = run(size, args.contacts_ratio, args.latency, args.error_rate, args.concurrency)
+
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f'{result["evaluations"]:>12} {result["seconds"]:>9.2f} {result["requests"]:>9} {result["rps"]:>8.0f} '
+                  f'{result["peak_rss"] / 1024**2:>12.1f} {result["output_bytes"] / 1024**2:>10.2f}')
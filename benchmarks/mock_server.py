@@ -0,0 +1,246 @@
+'''
+    Local stand-in for the Calabrio REST API, serving synthetic data at a configurable scale.
+
+    Implements the endpoints used by the extractors:
+        POST /authorize
+        GET  /recording/contact                     (date filters, searchStats, limit/offset paging)
+        GET  /recording/contact/{id}/eval/{id}
+        GET  /recording/contact/{id}/eval/{id}/comment
+        GET  /recording/evalform
+        GET  /org/common/agents/for/team/0
+        GET  /scheduling/adherence/agent/{id}
+
+    Latency and errors (429 with Retry-After, 503) can be injected on every GET.
+
+    Run standalone (serves until interrupted):
+        python -m benchmarks.mock_server --contacts 10000 --evaluations 1000 --latency 0.02
+'''
+
+# External libraries
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse, datetime as dt, json, random, re, threading, time
+
+BASE_TIME = 1609459200000           # 2021-01-01, epoch in milliseconds
+
+class MockCalabrio():
+    '''
+        Synthetic Calabrio API. Every payload is generated from its identifiers, so nothing is kept
+        in memory whatever the scale.
+            Args:
+                contacts        - Number of contacts returned by the search of all records
+                evaluations     - Number of evaluated contacts (the first ones of the search)
+                agents          - Number of agents in team 0
+                latency         - Seconds added to every GET
+                error_rate      - Share of GETs answered with an error (half 429, half 503)
+                search_limit    - Contacts returned by a search at most, as the API silently truncates
+                                  them (the count of searchStats is not limited)
+
+        Contacts start one second apart from 2021-01-01, and are evaluated one day after they start.
+    '''
+
+    def __init__(self, contacts: int = 1000, evaluations: int = 100, agents: int = 50,
+                 latency: float = 0, error_rate: float = 0, port: int = 0, search_limit: int = None) -> None:
+        self.contacts       = contacts
+        self.evaluations    = evaluations
+        self.search_limit   = search_limit
+        self.agents         = agents
+        self.latency        = latency
+        self.error_rate     = error_rate
+
+        self.requests       = 0
+        self.bytes_sent     = 0
+        self._lock          = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.__handler())
+        self.server.daemon_threads = True
+        self.url    = f'http://127.0.0.1:{self.server.server_port}/api/rest'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def contact(self, record: int) -> dict:
+        contact = {
+            'id':           record,
+            'startTime':    BASE_TIME + record * 1000,
+            'duration':     60 + record % 600,
+            'agent':        {'id': record % self.agents, 'name': f'Agent {record % self.agents}'},
+            'metadata':     {'queue': f'Queue {record % 12}', 'team': f'Team {record % 5}', 'language': 'en'},
+            'eventCalculations': {'holdTime': record % 90, 'talkTime': record % 300},
+        }
+        if record < self.evaluations:
+            contact['evaluation'] = {
+                'id':           1_000_000 + record,
+                'evaluated':    BASE_TIME + record * 1000 + 86_400_000,
+                'score':        record % 101,
+                'state':        'SCORED',
+            }
+        return contact
+
+    def evaluation(self, evaluation: int) -> dict:
+        return {
+            'id':       evaluation,
+            'score':    evaluation % 101,
+            'form':     {'id': evaluation % 3, 'name': f'Form {evaluation % 3}'},
+            'sections': [
+                {'id': section, 'name': f'Section {section}', 'score': (evaluation + section) % 101,
+                 'questions': [
+                     {'id': section * 10 + question, 'text': f'Question {section}.{question}',
+                      'answer': {'id': (evaluation + question) % 4, 'score': (evaluation + question) % 4}}
+                     for question in range(5)]}
+                for section in range(4)],
+        }
+
+    def comments(self, evaluation: int) -> list:
+        return [
+            {'$ref': f'{self.url}/recording/contact/0/eval/{evaluation}/comment/{evaluation * 10 + comment}',
+             'created': BASE_TIME + evaluation * 1000, 'text': f'Comment {comment} on evaluation {evaluation}'}
+            for comment in range(evaluation % 3)]
+
+    def forms(self) -> list:
+        return [
+            {'id': form, 'name': f'Form {form}', 'sections': [
+                {'id': section, 'name': f'Section {section}', 'questions': [
+                    {'id': section * 10 + question, 'text': f'Question {section}.{question}', 'options': [
+                        {'id': option, 'text': f'Option {option}', 'score': option} for option in range(4)]}
+                    for question in range(5)]}
+                for section in range(4)]}
+            for form in range(3)]
+
+    @staticmethod
+    def epoch(value: str) -> int:
+        '''
+            Milliseconds of a date (YYYY-MM-DD) or date and time (YYYY-MM-DDTHH:MM:SS) parameter.
+        '''
+        moment = dt.datetime.fromisoformat(value).replace(tzinfo=dt.timezone.utc)
+        return int(moment.timestamp() * 1000)
+
+    def search_range(self, query: dict) -> tuple[int, int]:
+        '''
+            Contacts [first, last) matched by the date filters of a search.
+        '''
+        def index(value: str, offset: int = 0) -> int:
+            return max(0, -(-(self.epoch(value) - BASE_TIME - offset) // 1000))
+
+        first, last = 0, self.contacts
+        if 'beginDate' in query:
+            first   = max(first, index(query['beginDate'][0]))
+        if 'endDate' in query:
+            last    = min(last, index(query['endDate'][0]))
+        if 'dateEvaluatedStart' in query:
+            first   = max(first, index(query['dateEvaluatedStart'][0], 86_400_000))
+            last    = min(last, self.evaluations, index(query['dateEvaluatedEnd'][0], 86_400_000))
+
+        return first, max(first, last)
+
+    def route(self, path: str, query: dict):
+        '''
+            Returns the payload for a GET, or None when the path is unknown.
+        '''
+        if path == '/recording/contact':
+            first, last = self.search_range(query)
+
+            if 'searchStats' in query:
+                return {'count': last - first}
+
+            if self.search_limit is not None:
+                last = min(last, first + self.search_limit)
+
+            offset  = int(query.get('offset', ['0'])[0])
+            limit   = int(query.get('limit', [str(last - first)])[0])
+            return [self.contact(record) for record in range(first + offset, min(last, first + offset + limit))]
+
+        match = re.fullmatch(r'/recording/contact/(\d+)/eval/(\d+)(/comment)?', path)
+        if match:
+            evaluation = int(match.group(2))
+            return self.comments(evaluation) if match.group(3) else self.evaluation(evaluation)
+
+        if path == '/recording/evalform':
+            return self.forms()
+
+        if path == '/org/common/agents/for/team/0':
+            return {'agents': [{'id': agent, 'firstName': 'Agent', 'lastName': f'{agent}'} for agent in range(self.agents)]}
+
+        match = re.fullmatch(r'/scheduling/adherence/agent/(\d+)', path)
+        if match:
+            agent = int(match.group(1))
+            return {'adherence': (agent % 100) / 100, 'scheduledMinutes': 480, 'actualMinutes': 480 - agent % 60}
+
+        return None
+
+    def __handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def send(self, status: int, payload, headers: dict = dict()) -> None:
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+                with mock._lock:
+                    mock.requests   += 1
+                    mock.bytes_sent += len(body)
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if urlparse(self.path).path.endswith('/authorize'):
+                    return self.send(200, {'sessionId': 'mock-session'})
+                self.send(404, {'error': 'Not found'})
+
+            def do_GET(self) -> None:
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                draw = random.random()
+                if draw < mock.error_rate / 2:
+                    return self.send(429, {'error': 'Too many requests'}, {'Retry-After': '0.1'})
+                if draw < mock.error_rate:
+                    return self.send(503, {'error': 'Service unavailable'})
+
+                url     = urlparse(self.path)
+                path    = url.path.split('/api/rest', 1)[-1]
+                payload = mock.route(path, parse_qs(url.query))
+
+                if payload is None:
+                    return self.send(404, {'error': 'Not found'})
+                self.send(200, payload)
+
+        return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Calabrio REST API')
+    parser.add_argument('--port',           type=int,   default=8080)
+    parser.add_argument('--contacts',       type=int,   default=1000)
+    parser.add_argument('--evaluations',    type=int,   default=100)
+    parser.add_argument('--agents',         type=int,   default=50)
+    parser.add_argument('--latency',        type=float, default=0)
+    parser.add_argument('--error-rate',     type=float, default=0)
+    parser.add_argument('--search-limit',   type=int,   default=None)
+    args = parser.parse_args()
+
+    mock = MockCalabrio(args.contacts, args.evaluations, args.agents, args.latency, args.error_rate, args.port,
+                        args.search_limit)
+    print(f'Serving {mock.url}')
+    mock.server.serve_forever()
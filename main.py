@@ -1,52 +1,155 @@
 # Internal references
-from modules.api_caller import ApiCaller
-from modules.auxiliar import Config
+from modules.config import Config
+from modules.scheduler import DONE, WindowScheduler, plan_windows
 
 # External libraries
-from dateutil.relativedelta import relativedelta
+import argparse
 import datetime as dt
 import logging
-import pandas as pd
 
-cfg     = Config('config.yaml')
+'''
+    Command line of the extraction. Each command loads only what it needs: the configuration is read
+    once the arguments are parsed, and the API modules (pandas, requests...) are imported by the
+    commands that call the API.
 
-# Logging format and configuration file
-log_format = '%(asctime)s - %(message)s'
-logging.basicConfig(filename=cfg.log_file, format=log_format, level=logging.INFO, force=True)
+        python main.py [export]                     Every entity, by windows, resuming from the checkpoint
+        python main.py records|evaluations|agents   A single entity, for every window between --start and --end
+        python main.py forms                        Evaluation forms (they don't depend on dates)
+        python main.py plan                         Windows of the export and their status, without calling the API
+        python main.py compact                      Merges the small files of every partition under ./output
+        python main.py config                       Checks the configuration and the token
+'''
 
+def parse_date(value: str) -> dt.date:
+    return dt.datetime.strptime(value, '%Y-%m-%d').date()
+
+def date_range(cfg: Config, args) -> tuple[dt.date, dt.date]:
+    min_date:dt.date    = args.start or parse_date(cfg.start_date)
+    max_date:dt.date    = args.end or dt.date.today()
+    return min_date, max_date
+
+def extract(cfg: Config, windows: list[tuple[dt.date, dt.date]], entities: tuple, checkpoint_file: str = None) -> bool:
+    '''
+        Runs the windows with the given entities, logging in once. Returns True when all windows are done.
+    '''
+    from modules.api_caller import ApiCaller, runtime
+    from modules.api_connection import ApiConnection
+    from modules.auxiliar import WorkerPool
+
+    # The sink and state are created from the configuration given on the command line
+    runtime(cfg)
+
+    # Log in once, the same session and workers are reused by every window
+    connection = ApiConnection(cfg)
+    pool       = WorkerPool(cfg.workers)
+
+    def run_window(date_min: dt.date, date_max: dt.date) -> None:
+        print(f'Max: {date_max} - Min: {date_min}')
+
+        caller  = ApiCaller(date_min, date_max, connection, pool, entities)
+        caller.load_data()
+        caller.export_data()
 
-if __name__ == '__main__':
     try:
-        min_date:dt.date    = dt.datetime.strptime(cfg.start_date, '%Y-%m-%d').date()
-        max_date:dt.date    = dt.date.today()
+        scheduler = WindowScheduler(checkpoint_file, cfg.parallel_windows)
+        return scheduler.run(windows, run_window)
+    finally:
+        pool.close()
+        connection.close()
 
-        relative_diff:relativedelta = relativedelta(max_date, min_date)
+def export(cfg: Config, args) -> None:
+    from modules.api_caller import ENTITIES
 
-        month_iters:int = (relative_diff.years*12) + relative_diff.months
-        day_iters:int   = relative_diff.days
+    # Replays export every window again from the recorded responses, the checkpoint of the export is left as it is
+    checkpoint_file = None if cfg.cache_mode == 'replay' else cfg.checkpoint_file
 
-        date_min = min_date
+    # Dates already covered by done windows are not planned again
+    windows         = WindowScheduler(checkpoint_file).plan(*date_range(cfg, args))
+    completed       = extract(cfg, windows, ENTITIES, checkpoint_file)
 
-        while(month_iters!=0 or day_iters!=0):
-            
-            if month_iters != 0:
-                date_diff = relativedelta(months=month_iters-1, days=day_iters)
-                month_iters = month_iters - 1
-            else:
-                date_diff = relativedelta(days=day_iters-1)
-                day_iters = day_iters - 1
+    if not completed:
+        logging.warning(f'Some windows failed, run again to resume them (see {checkpoint_file})')
 
- 
-            date_min = dt.datetime.strptime(str(date_min), '%Y-%m-%d').date()
-            date_max = dt.date.today() - date_diff
+def extract_entity(cfg: Config, args) -> None:
+    # Refreshes are not checkpointed, the state already skips what was exported
+    completed = extract(cfg, plan_windows(*date_range(cfg, args)), (args.command, ))
 
-            print(f'Max: {date_max} - Min: {date_min}')
+    if not completed:
+        logging.warning(f'Some windows of {args.command} failed')
 
-            caller  = ApiCaller(date_min, date_max)
-            caller.load_data()
-            caller.export_data()
+def forms(cfg: Config, args) -> None:
+    today = dt.date.today()
+    extract(cfg, [(today, today + dt.timedelta(days=1))], ('forms', ))
 
-            date_min = date_max
-    
+def plan(cfg: Config, args) -> None:
+    scheduler           = WindowScheduler(cfg.checkpoint_file)
+    min_date, max_date  = date_range(cfg, args)
+
+    # The period already done is listed once, export plans the windows after it
+    resume_date = min(scheduler.resume_date(min_date), max_date)
+    if resume_date > min_date:
+        print(f'{min_date} - {resume_date}\t{DONE}')
+
+    for date_min, date_max in scheduler.plan(min_date, max_date):
+        print(f'{date_min} - {date_max}\t{scheduler.status(date_min, date_max)}')
+
+def compact(cfg: Config, args) -> None:
+    from modules import compaction
+
+    compaction.compact(args.root, cfg.target_file_size, cfg.compression, cfg.compression_level, cfg.row_group_size)
+
+def check_config(cfg: Config, args) -> None:
+    try:
+        cfg.api_password
+        token = 'decrypted'
+    except Exception as e:
+        logging.exception(e)
+        token = f'could not be decrypted ({e.__class__.__name__})'
+
+    print(f'API:        {cfg.api_url} as {cfg.api_user}')
+    print(f'Start date: {cfg.start_date}')
+    print(f'Sink:       {cfg.sink}')
+    print(f'Token:      {token}')
+
+def parse_arguments(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Extracts the data of Calabrio Cloud')
+    parser.add_argument('--config', default='config.yaml', help='Configuration file (default: config.yaml)')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    # Without a command, everything is exported
+    parser.set_defaults(command='export', run=export, start=None, end=None)
+
+    def add_command(name: str, run, description: str, dates: bool = True):
+        command = commands.add_parser(name, help=description, description=description)
+        command.set_defaults(run=run)
+        if dates:
+            command.add_argument('--start', type=parse_date, help='First date (YYYY-MM-DD), defaults to general.start_date')
+            command.add_argument('--end',   type=parse_date, help='Last date, excluded (YYYY-MM-DD), defaults to today')
+        return command
+
+    add_command('export',       export,         'Extracts every entity by windows, resuming from the checkpoint')
+    add_command('records',      extract_entity, 'Extracts the contacts')
+    add_command('evaluations',  extract_entity, 'Extracts the evaluated contacts and their answers')
+    add_command('agents',       extract_entity, 'Extracts the agents and their schedules')
+    add_command('forms',        forms,          'Extracts the evaluation forms', dates=False)
+    add_command('plan',         plan,           'Lists the windows of the export and their status')
+    add_command('config',       check_config,   'Checks the configuration and the token', dates=False)
+
+    compact_command = add_command('compact', compact, 'Merges the small Parquet files of every partition', dates=False)
+    compact_command.add_argument('root', nargs='?', default='./output', help='Folder or URI to compact (default: ./output)')
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args    = parse_arguments()
+    cfg     = Config(args.config)
+
+    # Logging format and configuration file
+    log_format = '%(asctime)s - %(threadName)s - %(message)s'
+    logging.basicConfig(filename=cfg.log_file, format=log_format, level=logging.INFO, force=True)
+
+    try:
+        args.run(cfg, args)
     except Exception as e:
-        logging.exception(e)
\ No newline at end of file
+        logging.exception(e)
@@ -1,71 +1,134 @@
 # Internal references
 from modules.api_connection import ApiConnection
-from modules.auxiliar import Config
+from modules.auxiliar import Config, TableBuffer, WorkerPool
+from modules.fetch_state import FetchState
+from modules.pipeline import ExportPipeline
+from modules.schemas import apply_schema
 
 # External libraries
 import datetime as dt
-import logging, math
+import logging, threading
 import pandas as pd
 
 class Agents():
 
-    def __init__(self, configuration: Config) -> None:
+    # The roster is requested once per run, and shared by every window
+    _roster: pd.DataFrame   = None
+    _roster_lock            = threading.Lock()
+
+    def __init__(self, configuration: Config, connection: ApiConnection, pool: WorkerPool, state: FetchState,
+                 pipeline: ExportPipeline = None) -> None:
         self.cfg        = configuration
-        self.caller     = ApiConnection(configuration)
-        self._headers   = self.caller.headers
+        self.caller     = connection
+        self.pool       = pool
+        self.state      = state
+        self.pipeline   = pipeline
         self._url       = self.caller.url
 
+        # (agentId, scheduleDate) pairs loaded by this instance, stored in the state once exported
+        self.loaded_schedules: list[tuple[int, str]] = list()
+
+        # Requests that failed once their retries ran out, the window is not complete
+        self.failures: list[str]    = list()
+
         # Agent's data
         self.df_agent_data          = pd.DataFrame()
         self.df_agent_schedules     = pd.DataFrame()
 
-    def load_agents(self, schedule_date: str) -> None:
+    def load_agents(self, start_date: dt.date, end_date: dt.date = None) -> None:
         '''
-            This method will obtain all agents listed under Team 0 (All active agents).
+            This method will obtain all agents listed under Team 0 (All active agents), then their
+            schedule and adherence for every date of the window.
+                Args:
+                    start_date  -   First date of the window
+                    end_date    -   End of the window, excluded (it starts the next window).
+                                    Defaults to a single day
         '''
 
-        # Internal references
-        from modules.auxiliar import FileProcessing
-
-        fp = FileProcessing(self.cfg)
-
         try:
             start_time = dt.datetime.now()
 
-            self.schedule_date = schedule_date
-            #  URL  to obtain the data (team 0 lists all agents for the organization)
-            url = f'{self._url}/org/common/agents/for/team/0'
-            json_agents = self.caller.get(url)
+            df_agents = self.__load_roster()
 
-            # Reading only the agents from the team
-            df_agents   = pd.json_normalize(json_agents['agents'])
-            df_agents   = df_agents.rename(columns={'id': 'agentId'})
-            self.df_agent_data  = pd.concat([self.df_agent_data, df_agents], ignore_index = True)
-            
-            df_schedules = fp.parallel_process(df_agents['agentId'], 250, self._load_agents_schedule, 'schedules')
-            self.df_agent_schedules   = pd.concat([self.df_agent_schedules, df_schedules], ignore_index = True)
+            end_date = end_date or start_date + dt.timedelta(days=1)
+            dates    = [date.strftime('%Y-%m-%d') for date in pd.date_range(start_date, end_date - dt.timedelta(days=1))]
+
+            # Every agent for every date, except the ones already exported
+            pairs    = [(agent_id, date) for agent_id in df_agents['agentId'] for date in dates]
+            pending  = self.state.pending_schedules(pairs)
+
+            if self.pipeline is not None:
+                self.__stream_schedules(pending)
+            else:
+                df_schedules = self.pool.process(pending, self._load_agents_schedule, 'schedules')
+                df_schedules = apply_schema(df_schedules, 'df_agent_schedules')
+                self.df_agent_schedules   = pd.concat([self.df_agent_schedules, df_schedules], ignore_index = True)
+                self.__schedules_loaded(df_schedules)
 
             logging.info(f'Time elapsed for agents and schedules data:    {dt.datetime.now()-start_time}')
 
         except Exception as e:
             logging.exception(e)
+            self.failures.append(f'Agents from {start_date}: {e}')
+
+    def __stream_schedules(self, pending: list[tuple[int, str]]) -> None:
+        '''
+            Sends the schedules to the export pipeline in batches of cfg.batch_size, as they arrive.
+        '''
+        logging.info(f'{len(pending)} items will be processed with {self.pool.workers} workers for schedules')
 
-    def _load_agents_schedule(self, agent_id: int) -> pd.DataFrame:
+        buffer = TableBuffer()
+        for result in self.pool.imap_unordered(self._load_agents_schedule, pending):
+            if result is not None:
+                buffer.append(result)
+
+            if len(buffer) >= self.cfg.batch_size:
+                self.__send_schedules(buffer)
+                buffer = TableBuffer()
+
+        self.__send_schedules(buffer)
+
+    def __send_schedules(self, buffer: TableBuffer) -> None:
+        df_schedules = apply_schema(buffer.to_frame(), 'df_agent_schedules')
+        self.pipeline.put('df_agent_schedules', df_schedules)
+        self.__schedules_loaded(df_schedules)
+
+    def __schedules_loaded(self, df_schedules: pd.DataFrame) -> None:
+        if len(df_schedules) > 0:
+            self.loaded_schedules.extend(zip(df_schedules['agentId'], df_schedules['scheduleDate'].dt.strftime('%Y-%m-%d')))
+
+    def __load_roster(self) -> pd.DataFrame:
+        '''
+            Returns the agents of Team 0, requested only by the first window of the run.
+            That window also exports them (df_agent_data).
         '''
-            This method will iterate through each given agent to obtain the planned schedule,
+        with Agents._roster_lock:
+            if Agents._roster is None:
+                #  URL  to obtain the data (team 0 lists all agents for the organization)
+                url = f'{self._url}/org/common/agents/for/team/0'
+                json_agents = self.caller.get(url)
+
+                # Reading only the agents from the team
+                df_agents   = pd.json_normalize(json_agents['agents'])
+                df_agents   = df_agents.rename(columns={'id': 'agentId'})
+                df_agents   = apply_schema(df_agents, 'df_agent_data')
+
+                self.df_agent_data  = df_agents
+                Agents._roster      = df_agents
+
+            return Agents._roster
+
+    def _load_agents_schedule(self, schedule: tuple[int, str]) -> dict:
+        '''
+            This method will obtain, for the given agent and date, the planned schedule
             and the actual time spent to verify the adherence.
             No data transformation is done.
                 Args:
-                    dfAgents    -   dataframe of agents, obtained from list_agents
-                    schDays     -   number of days in the past from which the schedule will be obtained
+                    schedule    -   (agentId, scheduleDate) pair, the date as YYYY-MM-DD
         '''
-        df_schedules = pd.DataFrame()
         try:
-            #   Evaluate the date from which the schedule will be obtained
-            schDate = self.schedule_date
+            agent_id, schDate = schedule
 
-            # for agent_id in df_agents['agentId']:
-            # Iterate through the list of agents to obtain each schedule
             url = f'{self._url}/scheduling/adherence/agent/{agent_id}?date={schDate}'
             json_schedules = self.caller.get(url)
 
@@ -73,9 +136,9 @@ class Agents():
             json_schedules.update(id)
             json_schedules['scheduleDate'] = schDate
             
-            df_tmp_schedule = pd.json_normalize(json_schedules)
-            df_schedules = pd.concat([df_schedules, df_tmp_schedule], ignore_index=True)
-            return df_schedules
+            # Merged with the other schedules in a single pass by the worker pool
+            return json_schedules
         
         except Exception as e:
-            logging.exception(e)
\ No newline at end of file
+            logging.exception(e)
+            self.failures.append(f'Schedule of agent {schedule[0]} on {schedule[1]}: {e}')
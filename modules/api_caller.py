@@ -1,49 +1,118 @@
 # Internal dependencies
 from modules.api_agents import Agents
+from modules.api_connection import ApiConnection
 from modules.api_evaluations import Evaluations
 from modules.api_forms import Forms
 from modules.api_records import Records
-from modules.auxiliar import Config, FileProcessing
+from modules.auxiliar import WorkerPool
+from modules.config import Config
+from modules.fetch_state import FetchState
+from modules.metrics import metrics
+from modules.pipeline import ExportPipeline
+from modules.sinks import create_sink, wait_exports
 
 # External libraries
 from typing import Tuple
 import datetime as dt
-import logging
+import logging, threading
 import pandas as pd
 
-cfg = Config('config.yaml')
-files = FileProcessing(cfg)
+# Entities an ApiCaller can extract, all of them by default
+ENTITIES = ('records', 'evaluations', 'forms', 'agents')
+
+_runtime        = None
+_runtime_lock   = threading.Lock()
+
+def runtime(configuration: Config = None) -> tuple:
+    '''
+        Configuration, sink and state shared by every window of the process, created on first use
+        (from config.yaml, unless a configuration is given).
+    '''
+    global _runtime
+
+    with _runtime_lock:
+        if _runtime is None:
+            cfg = configuration or Config('config.yaml')
+            # Parquet files by default, or a database (export.sink)
+            sink = create_sink(cfg)
+            # When replaying recorded responses every evaluation and form is normalized again, nothing is persisted
+            # (and the sink replaces the files of the partitions written, see sinks.INCREMENTAL_TABLES)
+            state = FetchState(':memory:' if cfg.cache_mode == 'replay' else cfg.state_file)
+
+            _runtime = (cfg, sink, state)
+        return _runtime
 
 class ApiCaller():
-    def __init__(self, start_date: dt.date, end_date: dt.date) -> None:
+    def __init__(self, start_date: dt.date, end_date: dt.date, connection: ApiConnection = None, pool: WorkerPool = None,
+                 entities: tuple = ENTITIES) -> None:
         self.start_date = start_date
         self.end_date   = end_date
+        self.entities   = entities
+
+        # Configuration, sink and state of the process
+        cfg, sink, state = runtime()
+        self.cfg        = cfg
+        self.state      = state
+
+        # A single authenticated session is shared by all extractors (and by every window when provided)
+        self.connection  = connection if connection is not None else ApiConnection(cfg)
+        self.pool        = pool if pool is not None else WorkerPool(cfg.workers)
+
+        # Rows are written as soon as they are normalized, instead of once the whole window is loaded
+        self.pipeline    = ExportPipeline(sink, self.start_date, cfg.queue_size, self.state)
 
-        self.agents      = Agents(cfg)
-        self.evaluations = Evaluations(cfg)
-        self.forms       = Forms(cfg)
-        self.records     = Records(cfg)
+        self.agents      = Agents(cfg, self.connection, self.pool, self.state, self.pipeline)
+        self.evaluations = Evaluations(cfg, self.connection, self.pipeline)
+        self.forms       = Forms(cfg, self.connection, self.state)
+        self.records     = Records(cfg, self.connection, self.pipeline)
 
         self.instances   = [self.agents, self.evaluations, self.forms, self.records]
 
     def load_data(self) -> None:
-        run     = self.records.load_records(self.start_date, self.end_date, all_records = True)
+        '''
+            Extracts the entities of the caller (records, evaluations, forms, agents) for the window.
+        '''
+        self.pending_evaluations = pd.DataFrame()
 
-        if run == False:
-            logging.warning('The process completed as no data was found for the time period')
-            return
+        if 'records' in self.entities:
+            run     = self.records.load_records(self.start_date, self.end_date, all_records = True)
+
+            # Only the export of the contacts is skipped: contacts of previous windows may have been evaluated
+            # in this one, and agents have schedules. A failed search (None) is reported by export_data
+            if run == False:
+                logging.warning('No contacts were found for the time period')
+
+        if 'evaluations' in self.entities:
+            self.load_evaluations()
+
+        # Downloading all form information
+        if 'forms' in self.entities:
+            self.forms.get_form_data()
+
+        if 'agents' in self.entities:
+            self.agents.load_agents(self.start_date, self.end_date)
 
+    def load_evaluations(self) -> None:
         run     = self.records.load_records(self.start_date, self.end_date, all_records = False)
 
+        if not run:
+            return
+
         start_time = dt.datetime.now()
-        for index, record in self.records.df_eval_records.iterrows():
-            self.evaluations.load_answers(record['recordId'], record['evaluation.id'])     
-        logging.info(f'Time spent on evaluation details:    {dt.datetime.now()-start_time}')
-        
-        # Downloading all form information
-        self.forms.get_form_data()
 
-        self.agents.load_agents(self.start_date)
+        # Only evaluations that are new, or were scored again since the last export, are requested
+        self.pending_evaluations = self.state.pending_evaluations(self.records.df_eval_records)
+        self.evaluations.evaluated.update(zip(self.pending_evaluations['evaluation.id'].tolist(),
+                                              self.pending_evaluations['evaluation.evaluated'].tolist()))
+
+        if self.cfg.concurrency > 1 and len(self.pending_evaluations) > 0:
+            evaluations = zip(self.pending_evaluations['recordId'], self.pending_evaluations['evaluation.id'])
+            self.evaluations.load_answers_async(evaluations, self.cfg.concurrency)
+        else:
+            for index, record in self.pending_evaluations.iterrows():
+                self.evaluations.load_answers(record['recordId'], record['evaluation.id'])     
+        self.evaluations.build_tables()
+        logging.info(f'Time spent on evaluation details:    {dt.datetime.now()-start_time}')
     
     def export_data(self) -> None:
         dataframe_list: list[pd.DataFrame]  = list()
@@ -58,11 +127,40 @@ class ApiCaller():
             dataframe_list.extend(df_objects)
             dataframe_names.extend(df_names)
 
-        # Once all dataframes are loaded, export them to individual parquet files.
+        # The tables kept by the extractors (evaluated contacts, agents, forms) follow the streamed ones
         for item in range(0, len(dataframe_list)):
-            files.export(dataframe_list[item], dataframe_names[item], self.start_date)
-        
-        logging.info('The process completed successfully')\
+            self.pipeline.put(dataframe_names[item], dataframe_list[item])
+
+        # Uploads run in the background, the window is completed once they are all in the store
+        try:
+            wait_exports(self.pipeline.close())
+        except Exception:
+            # The contacts reserved by the window were not exported, other windows may write them
+            for table, rows in self.pipeline.exported_rows.items():
+                self.state.release_rows(table, rows)
+            raise
+
+        # Evaluations loaded in this window won't be requested again unless they are re-scored
+        if len(self.evaluations.loaded_evaluations) > 0:
+            loaded = self.pending_evaluations['evaluation.id'].isin(self.evaluations.loaded_evaluations)
+            self.state.mark_exported(self.pending_evaluations[loaded])
+
+        self.state.mark_schedules(self.agents.loaded_schedules)
+
+        # Contacts written in this window won't be written again unless they change
+        for table, rows in self.pipeline.exported_rows.items():
+            self.state.mark_rows(table, rows)
+
+        # Forms are exported again only once their definition changes
+        if self.forms.form_hash is not None:
+            self.state.save_payload_hash('evalform', self.forms.form_hash)
+
+        metrics.write_report(self.cfg.report_file, self.cfg.prometheus_file, self.start_date, self.end_date)
+
+        # What was loaded is exported and stored in the state, the window fails so the rest is requested again
+        failures = [failure for item in self.instances for failure in item.failures]
+        if len(failures) > 0:
+            raise RuntimeError(f'{len(failures)} request(s) failed for {self.start_date} - {self.end_date}, '
+                               f'the window is incomplete. First failure: {failures[0]}')
 
-        cfg.configuration['general']['start_date'] = self.end_date.strftime('%Y-%m-%d')
-        cfg.update(cfg.configuration)
\ No newline at end of file
+        logging.info(f'The process completed successfully for {self.start_date} - {self.end_date}')
\ No newline at end of file
@@ -1,34 +1,179 @@
-from modules.auxiliar import Config
+from modules.config import Config
+
+from modules.decoding import loads
+from modules.metrics import metrics
+from modules.rate_limiter import RateLimiter
+from modules.response_cache import ResponseCache
+
+# External libraries
+from requests.adapters import HTTPAdapter
+import logging, random, threading, time
 import requests
 
+# Responses worth retrying, besides throttling (429)
+RETRY_STATUS = (500, 502, 503, 504)
+
 class ApiConnection:
     '''
-        This class creates the cookie with session_id used to retrieve from Calabrio's API.
+        This class keeps the session (cookie with session_id) used to retrieve data from Calabrio's API.
+        A single instance is meant to be shared by every extractor: it logs in once, keeps a pool of
+        keep-alive connections and authenticates again by itself once the session cookie expires.
+
+        Responses can optionally be kept in a local store (api.cache_mode = record), and later
+        replayed from it without any network call (api.cache_mode = replay).
     '''
 
     def __init__(self, configuration: Config):
+        self.cfg = configuration
         self.url = configuration.api_url
-        
-        url_auth = f'{self.url}/authorize'           # Authentication URL
-
-        __credentials = dict(
-            userId   = configuration.api_user,       # ID of the tenant’s user
-            password = configuration.api_password,   # User’s password
-            locale   = 'en'                          # User’s language. Default = en
-        )
-
-        session_id = requests.request('POST', url_auth, json=__credentials).json()['sessionId']
-        self.headers = dict(cookie=f'hazelcast.sessionId={session_id}')
-        
-        # Save cookie for the session, as this will be used in all calls
-        configuration.configuration['session'] = self.headers
-
-        configuration.update(configuration.configuration)
-    def get(self, url) -> str:
+
+        self._lock       = threading.Lock()
+        self._generation = 0                         # Increases on every successful login
+
+        # Global budget of requests in flight, shared by every window and worker using this session
+        self._budget     = threading.BoundedSemaphore(configuration.request_budget)
+
+        # Adaptive throttling and retries
+        self.limiter      = RateLimiter(configuration.rate_limit, configuration.min_rate, configuration.max_rate)
+        self.timeout      = configuration.timeout
+        self.max_retries  = configuration.max_retries
+        self.backoff_base = 1
+        self.backoff_cap  = 60
+
+        # Pooled session, connections are reused between calls (keep-alive)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=configuration.pool_size, pool_maxsize=configuration.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'})
+
+        self.headers = dict()
+
+        # Raw response store, nothing is requested from the API when replaying
+        self.cache_mode  = configuration.cache_mode
+        self.cache       = ResponseCache(configuration.cache_folder) if self.cache_mode != 'off' else None
+
+        if self.cache_mode != 'replay':
+            self.authenticate()
+
+    def authenticate(self, generation: int = None) -> None:
+        '''
+            Requests a new session_id and stores it in the session headers.
+            When called with the generation seen by a failed request, the login is skipped if
+            another thread already refreshed the cookie in the meantime.
+        '''
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            url_auth = f'{self.url}/authorize'           # Authentication URL
+
+            __credentials = dict(
+                userId   = self.cfg.api_user,            # ID of the tenant’s user
+                password = self.cfg.api_password,        # User’s password
+                locale   = 'en'                          # User’s language. Default = en
+            )
+
+            response = self.session.post(url_auth, json=__credentials)
+            response.raise_for_status()
+
+            session_id = response.json()['sessionId']
+            self.headers = dict(cookie=f'hazelcast.sessionId={session_id}')
+            self.session.headers.update(self.headers)
+            self._generation += 1
+
+            logging.info('Session with Calabrio API established')
+
+            # Save cookie for the session, as this will be used in all calls
+            self.cfg.configuration['session'] = self.headers
+            self.cfg.update(self.cfg.configuration)
+
+    def get(self, url, decode = loads) -> str:
         '''
             This Method is to test the outcome from Calabrio of the URL provided
             Args URL(str)
+                 decode - Method that parses the body, loads by default (see modules.decoding)
+
+            Calls are throttled by the shared rate limiter. Throttled (429), server errors (5xx),
+            network errors and malformed responses are retried with jittered exponential backoff;
+            once the retries are exhausted the error is raised.
         '''
-        json_data = requests.request('GET', url, headers=self.headers).json()
-        return json_data
+        if self.cache_mode == 'replay':
+            body = self.cache.get(url)
+            if body is None:
+                raise LookupError(f'No recorded response for url: {url}')
+            return decode(body)
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+
+            try:
+                response = self.__request(url)
+
+                if response.status_code == 429:
+                    retry_after = self.__retry_after(response)
+                    self.limiter.throttled(retry_after)
+                    raise requests.HTTPError(f'429 Too Many Requests for url: {url}', response=response)
+
+                if response.status_code in RETRY_STATUS:
+                    raise requests.HTTPError(f'{response.status_code} Server Error for url: {url}', response=response)
+
+                response.raise_for_status()
+                json_data = decode(response.content)
+
+                if self.cache_mode == 'record':
+                    self.cache.put(url, response.content)
+                return json_data
+
+            except requests.HTTPError as e:
+                # Client errors (other than throttling) won't succeed on a retry
+                if e.response is not None and e.response.status_code not in RETRY_STATUS + (429, ):
+                    raise
+                error = e
+            except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+
+            # Exponential backoff with jitter, or the time requested by the server
+            wait = retry_after or min(self.backoff_cap, self.backoff_base * 2**attempt) * random.uniform(0.5, 1.5)
+            logging.warning(f'Retrying ({attempt + 1}/{self.max_retries}) in {wait:.1f}s after: {error}')
+            metrics.record_retry(url)
+            time.sleep(wait)
+
+    def __request(self, url: str) -> requests.Response:
+        generation = self._generation
+
+        response, latency = self.__send(url)
+
+        if response.status_code < 400:
+            self.limiter.success(latency)
+
+        # The session expired, log in again and repeat the call once
+        if response.status_code in (401, 419, 440):
+            logging.warning('Session expired, authenticating again')
+            self.authenticate(generation)
+            response, latency = self.__send(url)
+
+        return response
+
+    def __send(self, url: str) -> tuple[requests.Response, float]:
+        self.limiter.acquire()
+        with self._budget:
+            start_time = time.monotonic()
+            response = self.session.get(url, timeout=self.timeout)
+            latency = time.monotonic() - start_time
+
+        metrics.record_request(url, response.status_code, latency, len(response.content))
+        return response, latency
+
+    @staticmethod
+    def __retry_after(response: requests.Response) -> float:
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
 
+    def close(self) -> None:
+        self.session.close()
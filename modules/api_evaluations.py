@@ -1,26 +1,46 @@
 # Internal references
 from modules.api_connection import ApiConnection
-from modules.auxiliar import Config
+from modules.auxiliar import Config, TableBuffer
+from modules.decoding import nested_frame
+from modules.pipeline import ExportPipeline
+from modules.schemas import SCHEMAS, apply_schema
 
 # External libraries
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import datetime as dt
-import logging, math
+import logging
 import pandas as pd
 
 class Evaluations():
 
-    def __init__(self, configuration: Config) -> None:
+    def __init__(self, configuration: Config, connection: ApiConnection, pipeline: ExportPipeline = None) -> None:
 
-        self.caller         = ApiConnection(configuration)
-        self._headers       = self.caller.headers
+        self.caller         = connection
+        self.pipeline       = pipeline
+        self.batch_size     = configuration.batch_size
         self._url           = self.caller.url
 
+        # Evaluations whose details and comments were both loaded, stored in the state once exported
+        self.loaded_evaluations: list[int] = list()
+
+        # Time each evaluation was evaluated (from the evaluated records), its answers are partitioned by it
+        self.evaluated: dict[int, pd.Timestamp] = dict()
+
+        # Requests that failed once their retries ran out, the window is not complete
+        self.failures: list[str]    = list()
+
         # Evaluation dataframes
         self.df_eval_details    = pd.DataFrame()
         self.df_eval_sections   = pd.DataFrame()
         self.df_eval_questions  = pd.DataFrame()
         self.df_eval_comments   = pd.DataFrame()
 
+        # Payloads gathered while loading the answers, normalized in batches by build_tables
+        self._eval_details      = TableBuffer()
+        self._eval_sections     = list()
+        self._eval_comments     = list()
+
     def load_answers(self, record: int, evaluation: int) -> None:
         '''
         This method will iterate through the provided Evaluation ID and gather the answer for
@@ -36,72 +56,141 @@ class Evaluations():
 
             # Loading evaluation's data
             json_evaluation = self.caller.get(url)
-            df_evaluation   = pd.json_normalize(json_evaluation)
-        
-            # Appending the Evaluation ID to each dataframe
-            df_evaluation   = df_evaluation.rename(columns={'id': 'evaluationId'})
-            
-            self.df_eval_details  = pd.concat([self.df_eval_details, df_evaluation], ignore_index=True)
-
-            self.__load_eval_sections(json_evaluation, evaluation)
-            self.__load_eval_comments(url, evaluation)
         except Exception as e:
             logging.exception(e)
+            self.failures.append(f'Evaluation {evaluation}: {e}')
+            return
 
-    def __load_eval_sections(self, json_evaluation: str, evaluation_id: int) -> None:
+        # Without its comments the evaluation is left pending, to be requested again by the next run
         try:
-            # Expanding the 'Sections' data as it is a nested JSON
-            json_sections   = json_evaluation['sections']
-            df_sections     = pd.json_normalize(json_sections)
+            json_comments   = self.caller.get(f'{url}/comment')
+        except Exception as e:
+            logging.exception(e)
+            self.failures.append(f'Comments of evaluation {evaluation}: {e}')
+            return
 
-            # Adding the evaluation ID
-            df_sections['evaluationId'] = evaluation_id
+        self.__load_evaluation(json_evaluation, json_comments, evaluation)
 
-            self.df_eval_sections    = pd.concat([self.df_eval_sections, df_sections], ignore_index=True)
+    def load_answers_async(self, evaluations, concurrency: int) -> None:
+        '''
+        Asynchronous version of load_answers for many evaluations at once. The detail and comment
+        requests of several evaluations are kept in flight together, up to the given limit, and each
+        response goes through the same normalization as the serial method as soon as it arrives.
+        A fixed number of workers take the evaluations from the iterable as they go, so only the
+        evaluations in flight are held, however many there are.
+            Args:
+                evaluations     - Iterable of (record_id, evaluation_id) pairs
+                concurrency     - Maximum number of requests in flight
+        '''
+        asyncio.run(self.__fetch_answers(evaluations, concurrency))
 
-            self.__load_eval_questions(json_sections, evaluation_id)
-        except Exception as e:
-            logging.exception(e)
+    async def __fetch_answers(self, evaluations, concurrency: int) -> None:
+        loop        = asyncio.get_running_loop()
+        semaphore   = asyncio.Semaphore(concurrency)
+
+        # The pooled session is blocking, each in-flight request runs on its own worker thread
+        executor    = ThreadPoolExecutor(max_workers=concurrency)
+
+        async def fetch(url: str):
+            async with semaphore:
+                return await loop.run_in_executor(executor, self.caller.get, url)
+
+        async def fetch_evaluation(record: int, evaluation: int) -> None:
+            url = f'{self._url}/recording/contact/{record}/eval/{evaluation}'
+
+            json_evaluation, json_comments = await asyncio.gather(
+                fetch(url), fetch(f'{url}/comment'), return_exceptions=True)
+
+            if isinstance(json_evaluation, Exception):
+                logging.error(f'Evaluation {evaluation} could not be loaded', exc_info=json_evaluation)
+                self.failures.append(f'Evaluation {evaluation}: {json_evaluation}')
+                return
+            if isinstance(json_comments, Exception):
+                logging.error(f'Comments for evaluation {evaluation} could not be loaded', exc_info=json_comments)
+                self.failures.append(f'Comments of evaluation {evaluation}: {json_comments}')
+                return
+
+            self.__load_evaluation(json_evaluation, json_comments, evaluation)
+
+        # Workers share the iterator, each evaluation is taken by a single one
+        pairs = iter(evaluations)
+
+        async def worker() -> None:
+            for record, evaluation in pairs:
+                await fetch_evaluation(record, evaluation)
 
-    def __load_eval_questions(self, json_sections: str, evaluation_id: int) -> None:
         try:
-            # Loading question answers as these are contained by a nested json within the 'Sections' data
-            df_questions      = pd.DataFrame()
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        finally:
+            executor.shutdown(wait=False)
 
-            for item in json_sections:
-                tmp_df      = pd.json_normalize(item['questions'])
-                tmp_df['sectionId'] = item['id']
-                tmp_df      = tmp_df.rename(columns={'id': 'questionId'})
-                df_questions    = pd.concat([df_questions, tmp_df], ignore_index=True)
+    def __load_evaluation(self, json_evaluation: str, json_comments: list, evaluation: int) -> None:
+        try:
+            # Rows are only gathered here, the dataframes are built by build_tables
+            self._eval_details.append(json_evaluation)
 
-            # Adding the evaluation ID
-            df_questions['evaluationId'] = evaluation_id
+            # Sections (and their questions) keep the evaluation they belong to
+            self._eval_sections.append({'evaluationId': evaluation, 'sections': json_evaluation.get('sections')})
+            self._eval_comments.append({'evaluationId': evaluation, 'comments': json_comments})
+            self.loaded_evaluations.append(evaluation)
 
-            self.df_eval_questions   = pd.concat([self.df_eval_questions, df_questions], ignore_index=True)
+            # When streaming, every batch of evaluations is normalized and sent to the writer
+            if self.pipeline is not None and len(self._eval_details) >= self.batch_size:
+                self.build_tables()
         except Exception as e:
             logging.exception(e)
+            self.failures.append(f'Evaluation {evaluation}: {e}')
 
-    def __load_eval_comments(self, evaluation_url: str, evaluation_id: int) -> None:
+    def build_tables(self) -> None:
+        '''
+        Builds the evaluation dataframes from the payloads gathered by load_answers (or load_answers_async).
+        Called once all evaluations of the window were loaded, and for every batch when an export
+        pipeline is given, in which case the tables are sent to it and the buffers emptied.
+        Sections, questions and comments of the whole batch are flattened in a single pass each, with
+        the ids of their evaluation (and section) repeated on every row. Every table gets the time its
+        evaluation was evaluated (see the evaluated attribute).
+        '''
         try:
-            # Finally, loading the comments for the evaluation
-            url = f'{evaluation_url}/comment'
-            json_comments   = self.caller.get(url)
-
-            if len(json_comments) == 0:
+            df_details      = self._eval_details.to_frame().rename(columns={'id': 'evaluationId'})
+            df_sections     = nested_frame(self._eval_sections, ['sections'],
+                                           {'evaluationId': (0, 'evaluationId')}, SCHEMAS['df_eval_sections'])
+            df_questions    = nested_frame(self._eval_sections, ['sections', 'questions'],
+                                           {'sectionId': (1, 'id'), 'evaluationId': (0, 'evaluationId')})
+            df_questions    = df_questions.rename(columns={'id': 'questionId'})
+
+            df_details      = apply_schema(self.__add_evaluated(df_details), 'df_eval_details')
+            df_sections     = apply_schema(self.__add_evaluated(df_sections), 'df_eval_sections')
+            df_questions    = apply_schema(self.__add_evaluated(df_questions), 'df_eval_questions')
+
+            df_comments = nested_frame(self._eval_comments, ['comments'], {'evaluationId': (0, 'evaluationId')})
+
+            if len(df_comments) > 0:
+                # Cleaning column data
+                df_comments['$ref']     = df_comments['$ref'].str.replace(pat=r'^.*?comment/', repl='', regex=True)
+                df_comments = df_comments.rename(columns={'$ref': 'commentId'})
+
+            df_comments     = apply_schema(self.__add_evaluated(df_comments), 'df_eval_comments')
+
+            if self.pipeline is None:
+                self.df_eval_details    = df_details
+                self.df_eval_sections   = df_sections
+                self.df_eval_questions  = df_questions
+                self.df_eval_comments   = df_comments
                 return
 
-            df_comments = pd.json_normalize(json_comments)
-            
-            # Cleaning column data
-            df_comments['$ref']     = df_comments['$ref'].str.replace(pat=r'^.*?comment/', repl='', regex=True)
-            df_comments['created']  = pd.to_datetime(df_comments['created'], unit='ms').apply(lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(x) else math.nan)
-            
-            df_comments = df_comments.rename(columns={'$ref': 'commentId'})
-
-            # Adding the evaluation ID
-            df_comments['evaluationId'] = evaluation_id
-
-            self.df_eval_comments    = pd.concat([self.df_eval_comments, df_comments], ignore_index=True)
+            self.pipeline.put('df_eval_details', df_details)
+            self.pipeline.put('df_eval_sections', df_sections)
+            self.pipeline.put('df_eval_questions', df_questions)
+            self.pipeline.put('df_eval_comments', df_comments)
 
+            self._eval_details      = TableBuffer()
+            self._eval_sections     = list()
+            self._eval_comments     = list()
         except Exception as e:
-            logging.exception(e)
\ No newline at end of file
+            logging.exception(e)
+            self.failures.append(f'Evaluation tables: {e}')
+
+    def __add_evaluated(self, df: pd.DataFrame) -> pd.DataFrame:
+        if 'evaluationId' in df.columns:
+            df['evaluated'] = df['evaluationId'].map(self.evaluated)
+        return df
@@ -1,127 +1,91 @@
 # Internal references
 from modules.api_connection import ApiConnection
 from modules.auxiliar import Config
+from modules.fetch_state import FetchState
+from modules.schemas import apply_schema
 
 # External libraries
 import datetime as dt
-import logging, math
+import hashlib, json, logging
 import pandas as pd
 
 class Forms():
 
-    def __init__(self, configuration: Config) -> None:
+    def __init__(self, configuration: Config, connection: ApiConnection, state: FetchState) -> None:
 
-        self.caller         = ApiConnection(configuration)
-        self._headers       = self.caller.headers
+        self.caller         = connection
+        self.state          = state
         self._url           = self.caller.url
 
+        # Hash of the form payload flattened by this instance, None when the forms did not change
+        self.form_hash      = None
+
+        # Requests that failed once their retries ran out, the window is not complete
+        self.failures: list[str]    = list()
+
         # Form dataframes
         self.df_forms           = pd.DataFrame()
         self.df_form_sections   = pd.DataFrame()
         self.df_form_questions  = pd.DataFrame()
         self.df_form_options    = pd.DataFrame()
 
-    def get_form_data(self) -> list[pd.DataFrame]:
+    def get_form_data(self) -> None:
         '''
             Downloads the base data for the evaluation form, then uses the
-            expand_data method to navigate to the nested subtables.
+            __flatten_forms method to navigate to the nested subtables.
 
-            Returns a list of dataframes.
+            The payload is hashed and compared with the one of the last export, forms are only
+            flattened (and therefore exported) when their definition changed.
         '''
         try:
             start_time = dt.datetime.now()
             url_evalform = f'{self._url}/recording/evalform'
             
             json_forms      = self.caller.get(url_evalform)
-            df_forms        = pd.json_normalize(json_forms)
 
-            for item in json_forms:
-                self.__load_form_sections(item)
+            form_hash       = hashlib.sha256(json.dumps(json_forms, sort_keys=True).encode('utf-8')).hexdigest()
+
+            if form_hash == self.state.payload_hash('evalform'):
+                logging.info('Form definitions did not change since the last export, skipping them')
+                return
 
-            df_forms        = df_forms.rename(columns={'id': 'formId'})        
-            self.df_forms   = df_forms
+            self.__flatten_forms(json_forms)
+            self.form_hash  = form_hash
             
             logging.info(f'Time elapsed for form data:  {dt.datetime.now() - start_time}')
         except Exception as e:
             logging.exception(e)
+            self.failures.append(f'Evaluation forms: {e}')
 
-    def __load_form_sections(self, json_forms: str) -> None:
+    def __flatten_forms(self, json_forms: list) -> None:
         """
-        Method that expands the Sections column contained within each item of the Forms JSON.
-        
-        This does not return data, instead, it appends it to a dataframe stored within the class (self.df_form_sections)
-        
-        Similar to get_form_data, this method will then iterate through each row and call __load_form_questions
-        to expand the corresponding nested JSON.
+        Method that expands the nested Sections, Questions and Options contained within the Forms JSON.
+
+        The rows of each level are gathered with the IDs of their parents in a single pass over the
+        JSON, then each dataframe is normalized once.
 
         Args:
-            * json_forms: str ->  JSON String for each row of the Forms dataframe.
+            * json_forms: list ->  JSON list of forms, as returned by the API.
         """
-        try:
-            # Expanding the 'Sections' data as it is a nested JSON
-            json_sections   = json_forms['sections']
-            df_sections     = pd.json_normalize(json_sections)
-            df_sections['formId'] = json_forms['id']
+        sections, questions, options = list(), list(), list()
 
-            # Adding the form ID
-            df_sections     = df_sections.rename(columns={'id': 'sectionId'})
-            
-            for index, row in df_sections.iterrows():
-                self.__load_form_questions(row)
-
-            self.df_form_sections   = pd.concat([self.df_form_sections, df_sections], ignore_index=True)
-        except Exception as e:
-            logging.exception(e)
-
-    def __load_form_questions(self, df_sections: pd.Series) -> None:
-        """
-        Method that expands the Questions column contained within each row of the Sections dataframe.
-        
-        This does not return data, instead, it appends it to a dataframe stored within the class (self.df_form_questions)
-        
-        Similar to get_form_data, this method will then iterate through each row and call __load_form_options
-        to expand the corresponding nested JSON.
+        for form in json_forms:
+            for section in form.get('sections', []):
+                sections.append({**section, 'formId': form['id']})
 
-        Args:
-            * df_sections: pd.Series ->  Pandas Series that represents a row of the Sections dataframe.
-        """
-        try:
-            # Expanding the 'Questions' data as it is a nested JSON
-            json_questions   = df_sections['questions']
-            df_questions     = pd.json_normalize(json_questions)
-
-            # Adding previous IDs
-            df_questions['formId'] = df_sections['formId']
-            df_questions['sectionId'] = df_sections['sectionId']
-            df_questions    = df_questions.rename(columns={'id': 'questionId'})
-            
-            for index, row in df_questions.iterrows():
-                self.__load_form_options(row)
+                for question in section.get('questions', []):
+                    questions.append({**question, 'formId': form['id'], 'sectionId': section['id']})
 
-            self.df_form_questions   = pd.concat([self.df_form_questions, df_questions], ignore_index=True)
-        except Exception as e:
-            logging.exception(e)
+                    for option in question.get('options', []):
+                        options.append({
+                            **option, 'formId': form['id'], 'sectionId': section['id'], 'questionId': question['id']})
 
-    def __load_form_options(self, df_questions: str) -> None:
-        """
-        Method that expands the Options column contained within each row of the Questions dataframe.
-        
-        This does not return data, instead, it appends it to a dataframe stored within the class (self.df_form_options)
+        df_forms        = pd.json_normalize(json_forms).rename(columns={'id': 'formId'})
+        df_sections     = pd.json_normalize(sections).rename(columns={'id': 'sectionId'})
+        df_questions    = pd.json_normalize(questions).rename(columns={'id': 'questionId'})
+        df_options      = pd.json_normalize(options).rename(columns={'id': 'optionId'})
 
-        Args:
-            * df_questions: pd.Series ->  Pandas Series that represents a row of the Questions dataframe.
-        """
-        try:
-            # Expanding the 'Sections' data as it is a nested JSON
-            json_options    = df_questions['options']
-            df_options      = pd.json_normalize(json_options)
-
-            # Adding previous IDs
-            df_options['formId']    = df_questions['formId']
-            df_options['sectionId'] = df_questions['sectionId']
-            df_options['questionId'] = df_questions['questionId']
-            df_options  = df_options.rename(columns={'id': 'optionId'})
-        
-            self.df_form_options   = pd.concat([self.df_form_options, df_options], ignore_index=True)
-        except Exception as e:
-            logging.exception(e)
\ No newline at end of file
+        self.df_forms           = apply_schema(df_forms, 'df_forms')
+        self.df_form_sections   = apply_schema(df_sections, 'df_form_sections')
+        self.df_form_questions  = apply_schema(df_questions, 'df_form_questions')
+        self.df_form_options    = apply_schema(df_options, 'df_form_options')
@@ -1,10 +1,14 @@
 # Internal references
 from modules.api_connection import ApiConnection
-from modules.auxiliar import Config
+from modules.auxiliar import Config, TableBuffer
+from modules.decoding import decode_records
+from modules.pipeline import ExportPipeline
+from modules.schemas import SCHEMAS, apply_schema
 
 # External libraries
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
-import logging, math
+import logging, queue, threading
 import pandas as pd
 
 class Records:
@@ -12,18 +16,28 @@ class Records:
         This Class contains the methods to pull the data through different Calabrio API calls,
         each method returns at least one Pandas Dataframe.
     '''
-    def __init__(self, configuration: Config):
-        self.caller         = ApiConnection(configuration)
-        self._headers       = self.caller.headers
+    def __init__(self, configuration: Config, connection: ApiConnection, pipeline: ExportPipeline = None):
+        self.caller         = connection
+        self.pipeline       = pipeline
         self._url           = self.caller.url
 
+        self.page_size          = configuration.page_size
+        self.search_limit       = configuration.search_limit
+        self.eval_search_limit  = configuration.eval_search_limit
+        self.workers            = configuration.workers
+
+        # Requests that failed once their retries ran out, the window is not complete
+        self.failures: list[str]    = list()
+
         # Contact dataframes
         self.df_all_records     = pd.DataFrame()
         self.df_eval_records    = pd.DataFrame()
 
-    def load_records(self, date_start: dt.date, date_end: dt.date = dt.date.today(), all_records: bool = True) -> tuple[bool, pd.DataFrame]:
+    def load_records(self, date_start: dt.date, date_end: dt.date = dt.date.today(), all_records: bool = True) -> bool:
         '''
             This method will iterate through all interactions and their corresponding evaluation data.
+            Windows with more records than the search returns (api.search_limit, api.eval_search_limit)
+            are split into sub-windows under the limit, which are requested concurrently.
                 Args:
                     days_start    - Number of days from today to the evaluation date range start
                     days_end      - Number of days from today to the evaluation date range end
@@ -32,65 +46,46 @@ class Records:
         try:
             start_time = dt.datetime.now()
 
-            #   Query parsing elements depending on the allRecords arg
-            if all_records:
-                _date_query = f'beginDate={date_start}&endDate={date_end}'
-                _limit = '&limit=500000'
-            else:
-                _date_query = f'beginDate=2020-01-01&endDate={date_end}'
-                _date_evaluation_range = f'&dateEvaluatedStart={date_start}&dateEvaluatedEnd={date_end}'
-                _limit = '&limit=50000'
-
-            #   Standard parsing elements (do not modify)
-            _reason             = '&reason=recorded'
-            _search_scope       = '&searchScope=allEvaluations'
-            _metadata           = '&expand=metadata'
-            _event_calculations = '&expand=eventCalculations'
-
-            #   Assemble the query for the URL
-            if all_records:
-                query = (
-                    _date_query + _search_scope + _reason + _metadata +
-                    _event_calculations + _limit
-                )
-            else:
-                query = (
-                    _date_query + _date_evaluation_range + _search_scope + _reason + _metadata +
-                    _event_calculations + _limit
-                )
-            
-            url = f'{self._url}/recording/contact?{query}&searchStats=true'
-
-            # Evaluate numer of records within the specified time frame
-            call_count = self.caller.get(url)['count']
+            limit       = self.search_limit if all_records else self.eval_search_limit
+            windows     = self.plan_search(date_start, date_end, all_records, limit)
+            call_count  = sum(count for _, _, count in windows)
 
             # Once evaluated, determine if the entire process should run or not
             if int(call_count) == 0:
                 logging.warning(f'''Filtering between {date_start} - {date_end} returned no records.
-                Refer to {url}''')
+                Refer to {self.search_url(date_start, date_end, all_records)}&searchStats=true''')
                 data_found = False
-                df_records = pd.DataFrame()
-                return data_found, df_records
+                return data_found
             else:
-                logging.info(f'''Filtering between {date_start} - {date_end} shows a total of {call_count} record(s).
-                Refer to {url}''')
+                logging.info(f'''Filtering between {date_start} - {date_end} shows a total of {call_count} record(s)
+                in {len(windows)} search(es). Refer to {self.search_url(date_start, date_end, all_records)}&searchStats=true''')
                 data_found = True
 
-            url = f'{self._url}/recording/contact?{query}'
+            table       = 'df_all_records' if all_records else 'df_eval_records'
+            queries     = [self.search_query(start, end, all_records) for start, end, _ in windows]
+
+            records     = TableBuffer()
+            seen_ids    = set()
+
+            # Pages are formatted and deduplicated as they arrive, only a few raw pages are held at a time
+            for df_page in self.iter_searches(queries):
+                df_page = df_page.rename(columns={'id': 'recordId'})
 
-            df_records = pd.json_normalize(self.caller.get(url))
-            df_records = df_records.rename(columns={'id': 'recordId'})
+                #   Data formatting (timestamps and identifiers)
+                df_page = apply_schema(df_page, table)
 
-            dt_columns = ['startTime', 'evaluation.evaluated']
+                #   Remove duplicate records, within the page and against the previous pages (and sub-windows)
+                df_page = df_page.drop_duplicates(subset='recordId', keep="last")
+                df_page = df_page[~df_page['recordId'].isin(seen_ids)]
+                seen_ids.update(df_page['recordId'])
 
-            #   Data formatting
-            for column in dt_columns:
-                if column in df_records.columns:
-                    df_records[column] = pd.to_datetime(df_records[column], unit='ms').apply(
-                        lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(x) else math.nan)
+                # All contacts are written as they arrive, evaluated ones are kept to request their answers
+                if all_records and self.pipeline is not None:
+                    self.pipeline.put(table, df_page)
+                else:
+                    records.extend(df_page)
 
-            #   Remove duplicate records
-            df_records = df_records.drop_duplicates(subset='recordId', keep="last")
+            df_records = records.to_frame()
             
             if all_records:
                 logging.info(f'Time elapsed for all records:    {dt.datetime.now()-start_time}')
@@ -101,4 +96,162 @@ class Records:
 
             return data_found
         except Exception as e:
-            logging.exception(e)
\ No newline at end of file
+            logging.exception(e)
+            self.failures.append(f'{"Records" if all_records else "Evaluated records"} between {date_start} - {date_end}: {e}')
+
+    @staticmethod
+    def search_query(date_start: dt.datetime, date_end: dt.datetime, all_records: bool) -> str:
+        '''
+            Parameters of the contact search between both dates (or date and times, for sub-windows
+            shorter than a day).
+        '''
+        def format(value) -> str:
+            if isinstance(value, dt.datetime) and value.time() != dt.time():
+                return value.strftime('%Y-%m-%dT%H:%M:%S')
+            return value.strftime('%Y-%m-%d')
+
+        date_start, date_end = format(date_start), format(date_end)
+
+        #   Query parsing elements depending on the allRecords arg
+        if all_records:
+            _date_query = f'beginDate={date_start}&endDate={date_end}'
+        else:
+            _date_query = f'beginDate=2020-01-01&endDate={date_end}'
+            _date_evaluation_range = f'&dateEvaluatedStart={date_start}&dateEvaluatedEnd={date_end}'
+
+        #   Standard parsing elements (do not modify)
+        _reason             = '&reason=recorded'
+        _search_scope       = '&searchScope=allEvaluations'
+        _metadata           = '&expand=metadata'
+        _event_calculations = '&expand=eventCalculations'
+
+        #   Assemble the query for the URL
+        if all_records:
+            query = (
+                _date_query + _search_scope + _reason + _metadata +
+                _event_calculations
+            )
+        else:
+            query = (
+                _date_query + _date_evaluation_range + _search_scope + _reason + _metadata +
+                _event_calculations
+            )
+        return query
+
+    def search_url(self, date_start: dt.datetime, date_end: dt.datetime, all_records: bool) -> str:
+        return f'{self._url}/recording/contact?{self.search_query(date_start, date_end, all_records)}'
+
+    def plan_search(self, date_start: dt.date, date_end: dt.date, all_records: bool, limit: int) -> list[tuple]:
+        '''
+            Splits the window until the count of every sub-window is under the limit, in halves of whole
+            days first, and of whole hours once a sub-window is a single day.
+            Returns the (start, end, count) sub-windows with records, in order.
+                Args:
+                    limit   - Maximum number of records a search returns
+        '''
+        start   = dt.datetime.combine(date_start, dt.time())
+        end     = dt.datetime.combine(date_end, dt.time())
+
+        def count(start: dt.datetime, end: dt.datetime) -> int:
+            return int(self.caller.get(f'{self.search_url(start, end, all_records)}&searchStats=true')['count'])
+
+        def bisect(start: dt.datetime, end: dt.datetime, records: int) -> list[tuple]:
+            if records <= limit:
+                return [(start, end, records)] if records > 0 else list()
+
+            days, hours = (end - start).days, (end - start) // dt.timedelta(hours=1)
+            if days > 1:
+                middle = start + dt.timedelta(days=days // 2)
+            elif hours > 1:
+                middle = start + dt.timedelta(hours=hours // 2)
+            else:
+                logging.warning(f'{records} record(s) between {start} - {end} exceed the search limit of {limit}, '
+                                'the search may be truncated')
+                return [(start, end, records)]
+
+            return bisect(start, middle, count(start, middle)) + bisect(middle, end, count(middle, end))
+
+        windows = bisect(start, end, count(start, end))
+
+        if len(windows) > 1:
+            logging.info(f'Window {date_start} - {date_end} split into {len(windows)} searches under {limit} record(s)')
+        return windows
+
+    def iter_searches(self, queries: list[str]):
+        '''
+            Generator over the pages of several searches, requested concurrently (api.workers at most).
+            The pages are yielded as they arrive, a bounded number of them waits to be consumed.
+            Once every search ended, the error of the first one that failed is raised.
+        '''
+        if len(queries) == 1:
+            yield from self.iter_records(queries[0])
+            return
+
+        pages   = queue.Queue(maxsize=self.workers * 2)
+        done    = object()
+        stop    = threading.Event()
+        errors  = list()
+
+        def search(query: str) -> None:
+            try:
+                for page in self.iter_records(query):
+                    if stop.is_set():
+                        return
+                    pages.put(page)
+            except Exception as e:
+                logging.exception(e)
+                errors.append(e)
+            finally:
+                pages.put(done)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(queries))) as executor:
+            for query in queries:
+                executor.submit(search, query)
+
+            try:
+                remaining = len(queries)
+                while remaining > 0:
+                    page = pages.get()
+                    if page is done:
+                        remaining -= 1
+                    else:
+                        yield page
+
+                # A failed search leaves the records incomplete, the rest were still yielded
+                if len(errors) > 0:
+                    raise errors[0]
+            finally:
+                # Consumer stopped early: unblock the searches still running
+                stop.set()
+                while not pages.empty() or remaining > 0:
+                    try:
+                        if pages.get(timeout=0.1) is done:
+                            remaining -= 1
+                    except queue.Empty:
+                        pass
+
+    def iter_records(self, query: str, page_size: int = None):
+        '''
+            Generator over the contact search, requesting one page at a time with limit/offset.
+            Yields a normalized dataframe per page, so at most page_size records are held in memory.
+                Args:
+                    query       - Search parameters, as assembled by load_records
+                    page_size   - Number of records per request. Defaults to api.page_size
+        '''
+        page_size   = page_size or self.page_size
+        offset      = 0
+
+        while True:
+            url = f'{self._url}/recording/contact?{query}&limit={page_size}&offset={offset}'
+
+            # Decoded straight into columns, identifiers and timestamps are int64 arrays
+            df_page = self.caller.get(url, lambda body: decode_records(body, {'id': 'integer', **SCHEMAS['df_all_records']}))
+
+            if len(df_page) > 0:
+                yield df_page
+
+            # A short page is the last one
+            if len(df_page) < page_size:
+                return
+
+            offset += page_size
@@ -1,110 +1,147 @@
-import logging
+# Internal references
+from modules.config import Config
+from modules.metrics import metrics
+
+# External libraries
+import datetime as dt
+import logging, os, threading
 import pandas as pd
 from typing import Tuple
-from cryptography.fernet import Fernet
-
-class Config():
-    def __init__(self, filename: str):
-        # External libraries:
-        # from cryptography.fernet import Fernet
-        from os import getenv
-        from ruamel.yaml import round_trip_load, round_trip_dump
-
-        self.filename = filename
-        
-        try:
-            with open(filename, 'r') as f:
-                self.configuration = round_trip_load(f)
-
-            logging.info('Configuration read successfully')
-
-            # API Connection Info
-            self.api_url        = self.configuration['api']['url']
-            self.api_user       = self.configuration['api']['user']
-
-            ''' Use a hard-coded plain-text password if you don't have an encryption method,
-            else, refer to the token method below '''
-            # self.api_password   = ''
-
-            token               = self.configuration['general']['token']
-
-            cphr = Fernet(getenv('py_key'))
-            tkn_fl = open(token, 'rb')
-            tkn = tkn_fl.read()
-            self.api_password = cphr.decrypt(tkn).decode('utf-8')
-            
-            # Data for the run
-            self.start_date     = self.configuration['general']['start_date']
-            self.log_file       = self.configuration['general']['log_file']
-            
-            # Export information
-            self.bucket_name    = self.configuration['general']['bucket']
-            self.path        = self.configuration['general']['path']
-
-        except Exception as e:
-            logging.exception(e)
 
-    def update(self, configuration: str):
-        from ruamel.yaml import round_trip_dump
-
-        with open(self.filename, "w") as f:
-            round_trip_dump(configuration, f)
+def write_file(path: str, content) -> None:
+    '''
+        Writes the content (str or bytes) to a temporary file first, then replaces the file with it, so
+        readers and interrupted runs never see a partial file. The temporary file is named after the
+        thread, so concurrent writers of the same path don't overwrite each other's.
+    '''
+    temp_file = f'{path}.{threading.get_ident()}.tmp'
+    with open(temp_file, 'wb' if isinstance(content, bytes) else 'w') as f:
+        f.write(content)
+    os.replace(temp_file, path)
+
+class TableBuffer():
+    '''
+        Append-only accumulator for the rows of a table.
+        Rows (dicts) and partial dataframes are only gathered in lists while extracting, the
+        dataframe is built once with to_frame, so the cost grows linearly with the number of rows
+        instead of copying the accumulated table on every append.
+    '''
+
+    def __init__(self) -> None:
+        self._records: list[dict]           = list()
+        self._frames: list[pd.DataFrame]    = list()
+
+    def __len__(self) -> int:
+        return len(self._records) + sum(len(frame) for frame in self._frames)
+
+    def append(self, record: dict) -> None:
+        self._records.append(record)
+
+    def extend(self, records) -> None:
+        '''
+            Adds several rows at once, either a list of dicts or a dataframe.
+        '''
+        if isinstance(records, pd.DataFrame):
+            self._frames.append(records)
+        else:
+            self._records.extend(records)
+
+    def to_frame(self) -> pd.DataFrame:
+        '''
+            Builds the dataframe in a single pass. Nested dicts are flattened as json_normalize does.
+        '''
+        from modules.decoding import records_frame
+
+        frames = list(self._frames)
+        if len(self._records) > 0:
+            frames.append(records_frame(self._records))
+
+        if len(frames) == 0:
+            return pd.DataFrame()
+
+        df = pd.concat(frames, ignore_index=True)
+
+        # Categoricals with different categories are concatenated as objects, they are encoded again
+        categorical = {name for frame in frames for name, dtype in frame.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+        for name in categorical:
+            if not isinstance(df[name].dtype, pd.CategoricalDtype):
+                df[name] = df[name].astype('category')
+        return df
+
+class WorkerPool():
+    '''
+        Persistent pool of workers, created once and kept alive for the whole run.
+        Threads are used by default, as API calls spend their time waiting on the network and can share
+        the pooled session. Processes can be requested for CPU bound work, in which case the method and
+        its arguments must be picklable.
+    '''
+
+    def __init__(self, workers: int = 16, processes: bool = False) -> None:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        self.workers    = workers
+        executor        = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._executor  = executor(max_workers=workers)
+
+    def imap_unordered(self, method, items):
+        '''
+            Applies the method to every item, yielding the results as they complete.
+            Only a bounded number of items is submitted ahead of the workers.
+        '''
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        items   = iter(items)
+        pending = set()
+
+        while True:
+            for item in items:
+                pending.add(self._executor.submit(method, item))
+                if len(pending) >= self.workers * 2:
+                    break
+
+            if len(pending) == 0:
+                return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def process(self, items, method, process_name: str) -> pd.DataFrame:
+        '''
+            Runs the method for every item and merges the returned dataframes (or rows) once.
+            Items whose method returned None (failed calls) are skipped.
+        '''
+        logging.info(f'{len(items)} items will be processed with {self.workers} workers for {process_name}')
+
+        buffer = TableBuffer()
+        for result in self.imap_unordered(method, items):
+            if isinstance(result, dict):
+                buffer.append(result)
+            elif result is not None:
+                buffer.extend(result)
+        return buffer.to_frame()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
 
 class FileProcessing():
     # External libraries:
     import datetime as dt
     import pandas as pd
 
-    def __init__(self, config: Config, chunk_size: int = 500, local_process: bool = True) -> None:
-        self.chunk_size = chunk_size
+    def __init__(self, config: Config, local_process: bool = True) -> None:
         self.local_process = local_process
         self.cfg = config
-    
-    def split_chunks(self, df):
-        from math import ceil
-
-        """
-        Divide bigger datasets into chunks.
-        This function will mainly be used when loading historical data for all records
-        """
-
-        chunks = list()
-        num_chunks = ceil(len(df) / self.chunk_size)
-
-        for i in range(num_chunks):
-            start_index = i     * self.chunk_size
-            end_index   = (i+1) * self.chunk_size
-            chunks.append(df[start_index:end_index])
-
-        return chunks
-
-    def parallel_process(self, source_df: pd.DataFrame, split_size: int, method, process_name: str):       
-        # External libraries
-        from multiprocessing import Pool
-
-        chunks = self.split_chunks(source_df)
-
-        logging.info(f'{len(chunks)} iterations will be required to process all {process_name}')
+        self.run_id = dt.datetime.now().strftime('%Y%m%d%H%M%S')
 
-        pool = Pool(processes=16)
-        for item in chunks:
-            data = pool.map(method, [c for c in item])
-        pool.close()
-        
-        merged_df = pd.DataFrame()
-        
-        for x in data:
-            merged_df = pd.concat([merged_df, x], ignore_index = True)
-        return merged_df
-
-    def export(self, data: pd.DataFrame, table: str, bt: dt.datetime):
-
-        from os import path, makedirs
+        # Partitions already cleared of the files of previous runs when replaying, see open_writer
+        self._cleared: set[str] = set()
+        self._cleared_lock      = threading.Lock()
 
+    def partition_path(self, table: str, bt: dt.datetime) -> str:
         """
-        Upload the chunked datasets to S3, or generate them locally.
+        Folder (or S3 prefix) where the files of the table are written for the given date.
         """
-
         yy = bt.year
 
         # Formatting to two digits
@@ -115,20 +152,79 @@ class FileProcessing():
             bucket  = self.cfg.bucket_name
             path = f'{self.cfg.path}/{table.lower()}'
             
-            base_path = f's3://{bucket}/{path}/{yy}/{mm}/{dd}/'
-            
+            return f's3://{bucket}/{path}/{yy}/{mm}/{dd}'
         else:
-            base_path = f'./output/{table.lower()}/{yy}/{mm}/{dd}'
-            if not path.exists(base_path):
-                makedirs(base_path)
-
-        chunks = self.split_chunks(data)
-        logging.info(f"\t{len(chunks)} chunks will be generated for table - {table.replace('/', '.')}")
-        logging.info(f'\tExporting to {base_path}')
-
-        for iter, chunk in enumerate(chunks):
-            # Formatting to three digits
-            file_name = f'Chunk_{str(iter).zfill(3)}'
-            self.pd.DataFrame(chunk).to_parquet(
-                path=f'{base_path}/{file_name}.parquet',
-                compression='gzip', index=False)
\ No newline at end of file
+            return f'./output/{table.lower()}/{yy}/{mm}/{dd}'
+
+    def open_writer(self, table: str, bt: dt.datetime):
+        """
+        Opens a streaming Parquet writer for the table, batches can be written to it as they arrive.
+        Rows are partitioned by their event date (see schemas.EVENT_DATES), or by bt for tables without one.
+        The writer must be closed (or used as a context manager) to complete the last files.
+        """
+        from modules.parquet_writer import ParquetStreamWriter, PartitionedWriter
+        from modules.schemas import EVENT_DATES
+        from modules.sinks import INCREMENTAL_TABLES
+
+        # Incremental tables add files named after the run and window, the others replace the files of the partition.
+        # Replays write every row again, their incremental tables replace the files of previous runs instead
+        incremental = table in INCREMENTAL_TABLES
+        replay      = incremental and self.cfg.cache_mode == 'replay'
+
+        def open_partition(day: dt.date) -> ParquetStreamWriter:
+            path = self.partition_path(table, day)
+            if replay:
+                self.__clear_partition(path)
+
+            return ParquetStreamWriter(
+                path,
+                file_prefix         = f'part-{self.run_id}-{bt:%Y%m%d}' if incremental else 'part',
+                replace             = not incremental,
+                compression         = self.cfg.compression,
+                compression_level   = self.cfg.compression_level,
+                target_file_size    = self.cfg.target_file_size,
+                row_group_size      = self.cfg.row_group_size,
+                max_file_rows       = self.cfg.max_file_rows)
+
+        return PartitionedWriter(open_partition, EVENT_DATES.get(table), bt)
+
+    def __clear_partition(self, path: str) -> None:
+        """
+        Deletes the files written by previous runs in the partition, the first time the run writes to it.
+        Files of the current run (other windows of the same partition) are kept.
+        """
+        import pyarrow.fs
+
+        with self._cleared_lock:
+            if path in self._cleared:
+                return
+            self._cleared.add(path)
+
+            filesystem, folder = pyarrow.fs.FileSystem.from_uri(path) \
+                if '://' in path else (pyarrow.fs.LocalFileSystem(), path)
+
+            for info in filesystem.get_file_info(pyarrow.fs.FileSelector(folder, allow_not_found=True)):
+                if info.base_name.startswith('part-') and info.base_name.endswith('.parquet') \
+                        and not info.base_name.startswith(f'part-{self.run_id}-'):
+                    filesystem.delete_file(info.path)
+
+    def close_writer(self, table: str, writer) -> None:
+        """
+        Completes the last file of a writer opened with open_writer and records the table metrics.
+        """
+        writer.close()
+
+        logging.info(f"\t{len(writer.files)} file(s) generated in {len(writer.writers)} partition(s) for table - {table.replace('/', '.')}")
+        metrics.record_export(table, writer.rows_written, writer.bytes_written, len(writer.files))
+
+    def export(self, data: pd.DataFrame, table: str, bt: dt.datetime):
+        """
+        Upload the dataset to S3, or generate it locally, as row groups of files rolled by size.
+        """
+        if len(data) == 0:
+            logging.info(f"\tNo data to export for table - {table.replace('/', '.')}")
+            return
+
+        writer = self.open_writer(table, bt)
+        writer.write(data)
+        self.close_writer(table, writer)
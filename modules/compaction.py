@@ -0,0 +1,149 @@
+# Internal references
+from modules.parquet_writer import ParquetStreamWriter
+
+# External libraries
+import argparse, datetime as dt, json, logging, posixpath
+import pyarrow.fs
+import pyarrow.parquet as pq
+
+# Journal of the compaction in progress in a partition, see compact_partition
+JOURNAL = '_compaction.json'
+
+def _filesystem(root: str) -> tuple:
+    if '://' in root:
+        return pyarrow.fs.FileSystem.from_uri(root)
+    return pyarrow.fs.LocalFileSystem(), posixpath.normpath(root)
+
+def _is_data_file(info) -> bool:
+    # Hidden files (in progress compactions) and metadata (manifests, journals) are not data
+    return info.type == pyarrow.fs.FileType.File and info.base_name.endswith('.parquet') \
+        and not info.base_name.startswith(('.', '_'))
+
+def recover_partition(filesystem, path: str) -> None:
+    '''
+        Completes the compaction interrupted in the partition, if any. With a journal, the merged
+        files were complete: they are renamed and the files they replace deleted. Without one, merged
+        files left behind were never complete and are deleted.
+    '''
+    journal_path = f'{path}/{JOURNAL}'
+
+    if filesystem.get_file_info(journal_path).type == pyarrow.fs.FileType.File:
+        with filesystem.open_input_stream(journal_path) as stream:
+            journal = json.loads(stream.read())
+
+        logging.info(f'Completing the compaction interrupted in {path}')
+        _swap(filesystem, journal)
+        filesystem.delete_file(journal_path)
+
+    for info in filesystem.get_file_info(pyarrow.fs.FileSelector(path)):
+        if info.base_name.startswith('.compacting-') or info.base_name == f'{JOURNAL}.tmp':
+            filesystem.delete_file(info.path)
+
+def _swap(filesystem, journal: dict) -> None:
+    for temporary, final in journal['files'].items():
+        if filesystem.get_file_info(temporary).type == pyarrow.fs.FileType.File:
+            filesystem.move(temporary, final)
+
+    # A merged file never replaces itself
+    finals = set(journal['files'].values())
+    for replaced in journal['replaced']:
+        if replaced not in finals and filesystem.get_file_info(replaced).type == pyarrow.fs.FileType.File:
+            filesystem.delete_file(replaced)
+
+def compact_partition(filesystem, path: str, target_file_size: int = 128 * 1024**2,
+                      compression: str = 'zstd', compression_level: int = None, row_group_size: int = 100_000) -> int:
+    '''
+        Merges the files of the partition smaller than the target size into files of about that size.
+        Returns the number of files replaced.
+
+        The merged files are written under hidden names (ignored by Parquet readers), then a journal
+        listing them and the files they replace is written. Only then are they renamed and the small
+        files deleted, so an interruption at any point is completed (or undone) by recover_partition.
+            Args:
+                filesystem          - pyarrow filesystem of the partition
+                path                - Folder of the partition
+                target_file_size    - Size of the merged files, in bytes
+                row_group_size      - Rows of the row groups of the merged files, the small row groups of
+                                      the files replaced are merged into row groups of this size
+    '''
+    recover_partition(filesystem, path)
+
+    listing = filesystem.get_file_info(pyarrow.fs.FileSelector(path))
+
+    # Readers of the object store sink follow the manifest of the partition, its files are left as listed
+    if any(info.base_name == '_manifest.json' for info in listing):
+        logging.info(f'{path} is listed by a manifest, it is not compacted')
+        return 0
+
+    small = sorted(info.path for info in listing if _is_data_file(info) and info.size < target_file_size)
+    if len(small) < 2:
+        return 0
+
+    stamp   = dt.datetime.now().strftime('%Y%m%d%H%M%S%f')
+    writer  = ParquetStreamWriter(
+        path if isinstance(filesystem, pyarrow.fs.LocalFileSystem) else f'{filesystem.type_name}://{path}',
+        compression         = compression,
+        compression_level   = compression_level,
+        target_file_size    = target_file_size,
+        row_group_size      = row_group_size,
+        file_prefix         = f'.compacting-{stamp}',
+        replace             = False)
+
+    # Row groups are read one at a time, without loading whole files, and buffered by the writer until they
+    # add up to a row group of row_group_size rows
+    with writer:
+        for file_name in small:
+            with filesystem.open_input_file(file_name) as source:
+                parquet_file = pq.ParquetFile(source)
+                for index in range(parquet_file.num_row_groups):
+                    writer.write(parquet_file.read_row_group(index))
+
+    files   = {temporary: f'{path}/{posixpath.basename(temporary)[1:].replace("compacting", "part-compacted", 1)}'
+               for temporary in writer.files}
+    journal = {'files': files, 'replaced': small}
+
+    journal_path = f'{path}/{JOURNAL}'
+    with filesystem.open_output_stream(f'{journal_path}.tmp') as stream:
+        stream.write(json.dumps(journal, indent=4).encode())
+    filesystem.move(f'{journal_path}.tmp', journal_path)
+
+    _swap(filesystem, journal)
+    filesystem.delete_file(journal_path)
+
+    logging.info(f'{path}: {len(small)} file(s) compacted into {len(files)}')
+    return len(small)
+
+def compact(root: str, target_file_size: int = 128 * 1024**2, compression: str = 'zstd',
+            compression_level: int = None, row_group_size: int = 100_000) -> int:
+    '''
+        Compacts every partition (folder with Parquet files) under the root folder or URI, e.g.
+        ./output or ./output/df_all_records. Returns the number of files replaced.
+    '''
+    filesystem, root = _filesystem(root)
+
+    partitions = sorted({posixpath.dirname(info.path)
+                         for info in filesystem.get_file_info(pyarrow.fs.FileSelector(root, recursive=True))
+                         if _is_data_file(info) or info.base_name == JOURNAL})
+
+    replaced = 0
+    for partition in partitions:
+        try:
+            replaced += compact_partition(filesystem, partition, target_file_size, compression, compression_level,
+                                          row_group_size)
+        except Exception as e:
+            logging.exception(e)
+
+    logging.info(f'{replaced} file(s) compacted in {len(partitions)} partition(s) under {root}')
+    return replaced
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merges the small Parquet files of each partition')
+    parser.add_argument('root',                 nargs='?', default='./output', help='Folder or URI (s3://bucket/path) to compact')
+    parser.add_argument('--target-size-mb',     type=int, default=128)
+    parser.add_argument('--compression',        default='zstd')
+    parser.add_argument('--compression-level',  type=int)
+    parser.add_argument('--row-group-size',     type=int, default=100_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    compact(args.root, args.target_size_mb * 1024**2, args.compression, args.compression_level, args.row_group_size)
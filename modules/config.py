@@ -0,0 +1,101 @@
+# External libraries
+import logging
+
+class Config():
+    def __init__(self, filename: str):
+        # External libraries:
+        from ruamel.yaml import round_trip_load
+
+        self.filename = filename
+        
+        try:
+            with open(filename, 'r') as f:
+                self.configuration = round_trip_load(f)
+
+            logging.info('Configuration read successfully')
+
+            # API Connection Info
+            self.api_url        = self.configuration['api']['url']
+            self.api_user       = self.configuration['api']['user']
+            self.concurrency    = self.configuration['api'].get('concurrency', 1)
+            self.page_size      = self.configuration['api'].get('page_size', 5000)
+            # Records returned by a contact search at most, bigger windows are split
+            self.search_limit       = self.configuration['api'].get('search_limit', 500000)
+            self.eval_search_limit  = self.configuration['api'].get('eval_search_limit', 50000)
+            # Requests in flight at once across all windows and workers
+            self.request_budget = self.configuration['api'].get('request_budget', 32)
+            # Requests per second (adapted between min_rate and max_rate), timeouts and retries
+            self.rate_limit     = self.configuration['api'].get('rate_limit', 20)
+            self.min_rate       = self.configuration['api'].get('min_rate', 1)
+            self.max_rate       = self.configuration['api'].get('max_rate', 50)
+            self.timeout        = self.configuration['api'].get('timeout', 60)
+            self.max_retries    = self.configuration['api'].get('max_retries', 5)
+            # Raw response store: off, record (store every response) or replay (read only from the store)
+            self.cache_mode     = self.configuration['api'].get('cache_mode', 'off')
+            self.cache_folder   = self.configuration['api'].get('cache_folder', 'response_cache')
+            self.workers        = self.configuration['api'].get('workers', 16)
+            # Enough pooled connections for every request in flight
+            self.pool_size      = max(self.configuration['api'].get('pool_size', 10), self.concurrency, self.request_budget)
+
+            ''' Use a hard-coded plain-text password if you don't have an encryption method,
+            else, refer to the token method below (api_password) '''
+            self._api_password  = None
+
+            self.token          = self.configuration['general']['token']
+            
+            # Data for the run
+            self.start_date     = self.configuration['general']['start_date']
+            self.log_file       = self.configuration['general']['log_file']
+            self.state_file     = self.configuration['general'].get('state_file', 'calabrio_state.db')
+            self.checkpoint_file    = self.configuration['general'].get('checkpoint_file', 'calabrio_checkpoint.json')
+            self.report_file        = self.configuration['general'].get('report_file', 'calabrio_report.json')
+            self.prometheus_file    = self.configuration['general'].get('prometheus_file', 'calabrio.prom')
+            self.parallel_windows   = self.configuration['general'].get('parallel_windows', 1)
+            
+            # Export information
+            self.bucket_name    = self.configuration['general']['bucket']
+            self.path        = self.configuration['general']['path']
+
+            # Parquet output
+            export              = self.configuration.get('export') or dict()
+            self.compression        = export.get('compression', 'zstd')
+            self.compression_level  = export.get('compression_level')
+            self.row_group_size     = export.get('row_group_size', 100000)
+            self.target_file_size   = export.get('target_file_size_mb', 128) * 1024**2
+            self.max_file_rows      = export.get('max_file_rows', 1000000)
+            self.batch_size         = export.get('batch_size', 1000)
+            self.queue_size         = export.get('queue_size', 8)
+            self.sink               = export.get('sink', 'parquet')
+            self.database_url       = export.get('database_url', 'sqlite:///calabrio.db')
+            self.endpoint_url       = export.get('endpoint_url')
+            self.staging_folder     = export.get('staging_folder', 'staging')
+            self.upload_workers     = export.get('upload_workers', 8)
+            self.upload_queue       = export.get('upload_queue', 32)
+            self.multipart_threshold    = export.get('multipart_threshold_mb', 64) * 1024**2
+            self.multipart_chunksize    = export.get('multipart_chunksize_mb', 16) * 1024**2
+            self.multipart_concurrency  = export.get('multipart_concurrency', 8)
+
+        except Exception as e:
+            logging.exception(e)
+
+    @property
+    def api_password(self) -> str:
+        '''
+            Password of the API user, decrypted from the token file with the py_key environment variable.
+            Decrypted on first use, so commands that never log in don't need the key.
+        '''
+        if self._api_password is None:
+            from cryptography.fernet import Fernet
+            from os import getenv
+
+            cphr = Fernet(getenv('py_key'))
+            with open(self.token, 'rb') as tkn_fl:
+                self._api_password = cphr.decrypt(tkn_fl.read()).decode('utf-8')
+
+        return self._api_password
+
+    def update(self, configuration: str):
+        from ruamel.yaml import round_trip_dump
+
+        with open(self.filename, "w") as f:
+            round_trip_dump(configuration, f)
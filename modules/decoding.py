@@ -0,0 +1,206 @@
+'''
+    Fast decoding of the API payloads.
+
+    Bodies are parsed with orjson when it is installed (falling back to the standard json module), and
+    lists of records are flattened straight into columns (one list per flattened key), from which the
+    dataframe is built at once. This replaces json_normalize, which copies every record into a new
+    flat dict before building the dataframe row by row.
+
+    Contact search pages skip the list of dicts altogether: decode_records parses the body with
+    pyarrow's JSON reader straight into typed columns.
+'''
+
+# External libraries
+import pandas as pd
+
+try:
+    import orjson
+
+    def loads(body: bytes):
+        return orjson.loads(body)
+
+except ImportError:
+    import json
+
+    def loads(body: bytes):
+        return json.loads(body)
+
+def decode_records(body: bytes, schema: dict[str, str] = None) -> pd.DataFrame:
+    '''
+        Decodes a JSON array of records straight into a dataframe, with the same columns as
+        records_frame(loads(body)). The array is parsed by pyarrow's JSON reader into typed columns
+        (nested dicts become struct columns, flattened into 'parent.child' columns), so no Python
+        object is created per record or value, except for nested lists. Numbers and booleans are
+        typed by the reader, text is always kept as text (dates included).
+        Bodies the reader can't type (a key with values of different types across records) go through
+        loads and records_frame instead.
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.json
+
+        # The reader expects objects, the array is wrapped in one and read as a single row
+        wrapped = b'{"records":' + body + b'}'
+
+        def read(explicit_schema = None):
+            return pyarrow.json.read_json(
+                pa.py_buffer(wrapped),
+                read_options    = pyarrow.json.ReadOptions(block_size=len(wrapped) + 1),
+                parse_options   = pyarrow.json.ParseOptions(newlines_in_values=True, explicit_schema=explicit_schema))
+
+        table = read()
+
+        # The reader turns text that looks like a date into timestamps, only on pages where every value
+        # does. Those keys are read again as text, as json_normalize keeps them, so their type doesn't
+        # change from page to page
+        text_schema = _text_dates(table.schema)
+        if not text_schema.equals(table.schema):
+            table = read(text_schema)
+    except (ImportError, pa.ArrowInvalid):
+        return records_frame(loads(body), schema)
+
+    records = table.column('records').combine_chunks()
+    if not pa.types.is_struct(records.type.value_type):
+        # Empty array
+        return pd.DataFrame()
+
+    table = pa.Table.from_struct_array(records.flatten())
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+
+    # Nested lists are kept as Python lists, as json_normalize does
+    frame = dict()
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+            frame[name] = column.to_pylist()
+        elif pa.types.is_null(column.type):
+            frame[name] = [None] * len(column)
+        else:
+            frame[name] = column.to_pandas()
+
+    return pd.DataFrame(frame)
+
+def _text_dates(schema):
+    '''
+        Returns the schema with every date, time and timestamp type (nested ones included) replaced by string.
+    '''
+    import pyarrow as pa
+
+    def text(data_type):
+        if pa.types.is_timestamp(data_type) or pa.types.is_date(data_type) or pa.types.is_time(data_type):
+            return pa.string()
+        if pa.types.is_struct(data_type):
+            return pa.struct([field.with_type(text(field.type)) for field in data_type])
+        if pa.types.is_list(data_type):
+            return pa.list_(data_type.value_field.with_type(text(data_type.value_type)))
+        return data_type
+
+    return pa.schema([field.with_type(text(field.type)) for field in schema])
+
+def flatten_columns(records: list[dict], sep: str = '.') -> dict[str, list]:
+    '''
+        Flattens a list of (nested) records into columns, nested dicts become 'parent.child' keys
+        as in json_normalize. Keys missing from a record are filled with None.
+    '''
+    columns: dict[str, list] = dict()
+
+    def flatten(row: int, prefix: str, record: dict) -> None:
+        for key, value in record.items():
+            name = f'{prefix}{key}'
+
+            # As json_normalize does, an empty dict adds no column
+            if isinstance(value, dict):
+                flatten(row, f'{name}{sep}', value)
+                continue
+
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * row
+            elif len(column) < row:
+                column.extend([None] * (row - len(column)))
+            column.append(value)
+
+    for row, record in enumerate(records):
+        flatten(row, '', record)
+
+    # Columns absent from the last records
+    for column in columns.values():
+        if len(column) < len(records):
+            column.extend([None] * (len(records) - len(column)))
+
+    return columns
+
+def flatten_nested(records: list[dict], record_path: list[str], meta: dict[str, tuple[int, str]] = None,
+                   sep: str = '.') -> dict[str, list]:
+    '''
+        Flattens into columns the items of the nested lists found at record_path in every record, in a
+        single pass over the batch, as json_normalize(records, record_path, meta) does.
+        meta maps the columns added to every item to the (level, key) of the parent value to repeat:
+        level 0 is the record, 1 the items of the first list of the path, and so on.
+            e.g. flatten_nested(evaluations, ['sections', 'questions'], {'sectionId': (1, 'id')})
+    '''
+    meta    = meta or dict()
+    depth   = len(record_path)
+    items   = list()
+    parents = {name: list() for name in meta}
+
+    # Keys repeated from each level, a parent value is added once per item found below it
+    meta_keys = [[(parents[name], key) for name, (level, key) in meta.items() if level == index]
+                 for index in range(depth + 1)]
+
+    def walk(node: dict, level: int) -> int:
+        if level == depth:
+            items.append(node)
+            count = 1
+        else:
+            count = 0
+            for child in node.get(record_path[level]) or list():
+                count += walk(child, level + 1)
+
+        for values, key in meta_keys[level]:
+            values.extend([node.get(key)] * count)
+        return count
+
+    for record in records:
+        walk(record, 0)
+
+    columns = flatten_columns(items, sep)
+    # As in json_normalize, meta columns are added last (and replace item keys of the same name)
+    for name, values in parents.items():
+        columns.pop(name, None)
+        columns[name] = values
+
+    return columns
+
+def records_frame(records: list[dict], schema: dict[str, str] = None) -> pd.DataFrame:
+    '''
+        Builds the dataframe of a list of records from its flattened columns.
+        Columns declared as integer or timestamp in the schema (see modules.schemas) are built as int64
+        arrays directly when they have no missing values.
+    '''
+    return columns_frame(flatten_columns(records), schema)
+
+def nested_frame(records: list[dict], record_path: list[str], meta: dict[str, tuple[int, str]] = None,
+                 schema: dict[str, str] = None) -> pd.DataFrame:
+    '''
+        Builds the dataframe of the nested items of a batch of records, see flatten_nested.
+    '''
+    return columns_frame(flatten_nested(records, record_path, meta), schema)
+
+def columns_frame(columns: dict[str, list], schema: dict[str, str] = None) -> pd.DataFrame:
+    schema  = schema or dict()
+    frame   = dict()
+
+    for name, values in columns.items():
+        kind = schema.get(name)
+
+        if kind in ('integer', 'timestamp') and None not in values:
+            try:
+                frame[name] = pd.array(values, dtype='int64')
+                continue
+            except (TypeError, ValueError, OverflowError):
+                pass
+
+        frame[name] = values
+
+    return pd.DataFrame(frame)
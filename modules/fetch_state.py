@@ -0,0 +1,242 @@
+# External libraries
+import hashlib, logging, sqlite3, threading
+import numpy as np
+import pandas as pd
+
+def row_hashes(df_rows: pd.DataFrame) -> np.ndarray:
+    '''
+        Hash of every row from its non-null (column, value) pairs only, so the same row hashes the same
+        whatever other columns its page has (sparse metadata, evaluation columns of other records).
+        Numbers are hashed as float64, whether the page inferred them as integers or floats, and
+        other values (text, nested lists) by their text. Each column hash is mixed with the name of
+        the column, and the columns are added, which doesn't depend on their order.
+    '''
+    hashes = np.zeros(len(df_rows), dtype='uint64')
+
+    for name in df_rows.columns:
+        column  = df_rows[name]
+        is_set  = column.notna().values
+
+        if pd.api.types.is_numeric_dtype(column):
+            column = column.astype('float64')
+        elif not pd.api.types.is_datetime64_any_dtype(column):
+            column = column.astype(str)
+
+        name_hash   = np.uint64(int.from_bytes(hashlib.blake2b(str(name).encode(), digest_size=8).digest(), 'little'))
+        values      = pd.util.hash_pandas_object(column, index=False).values
+        hashes     += np.where(is_set, (values ^ name_hash) * np.uint64(0x9E3779B97F4A7C15), np.uint64(0))
+
+    return hashes.astype('int64')
+
+class FetchState():
+    '''
+        Local store (SQLite) of the evaluations that were already fetched and exported.
+        Each evaluation is kept with the time it was evaluated, so only new or re-scored evaluations
+        need their details and comments requested again. The same is kept for the (agent, date)
+        schedules, and for the hash of payloads that rarely change (evaluation forms), to export them
+        only when they do.
+
+        Contacts are found again by overlapping windows and by every search of evaluated records, the
+        exported ones are indexed by recordId with a hash of their row, so only new or changed rows
+        are written again. Rows being written by a window are reserved in memory until the window
+        stores them, so windows running at the same time don't write them twice.
+    '''
+
+    def __init__(self, filename: str) -> None:
+        self.filename   = filename
+        self._lock      = threading.Lock()
+
+        # Hash of the rows written by the windows in progress, by (table, recordId)
+        self._reserved: dict[tuple[str, int], int] = dict()
+
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS evaluations (
+                evaluationId    INTEGER PRIMARY KEY,
+                recordId        INTEGER,
+                evaluated       TEXT,
+                exported        TEXT
+            )''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS schedules (
+                agentId         INTEGER,
+                scheduleDate    TEXT,
+                exported        TEXT,
+                PRIMARY KEY (agentId, scheduleDate)
+            )''')
+        # Schedules are looked up by the dates of a window
+        self.connection.execute('CREATE INDEX IF NOT EXISTS schedules_date ON schedules (scheduleDate)')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS exported_rows (
+                tableName       TEXT,
+                recordId        INTEGER,
+                rowHash         INTEGER,
+                PRIMARY KEY (tableName, recordId)
+            ) WITHOUT ROWID''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS payloads (
+                name            TEXT PRIMARY KEY,
+                hash            TEXT,
+                exported        TEXT
+            )''')
+        self.connection.commit()
+
+    def pending_evaluations(self, df_records: pd.DataFrame) -> pd.DataFrame:
+        '''
+            Returns the evaluated records whose evaluation is unknown, or was evaluated again
+            since the last successful export.
+                Args:
+                    df_records  - Evaluated records, with 'evaluation.id' and 'evaluation.evaluated'
+        '''
+        if len(df_records) == 0:
+            return df_records
+
+        # Only the evaluations of the window are looked up
+        evaluation_ids  = df_records['evaluation.id'].tolist()
+        with self._lock:
+            known       = self.__select_in('SELECT evaluationId, evaluated FROM evaluations WHERE evaluationId IN ({})',
+                                           [int(evaluation) for evaluation in evaluation_ids if pd.notna(evaluation)])
+
+        evaluated   = df_records['evaluation.evaluated'].astype(str).tolist()
+        is_pending  = [known.get(evaluation) != date for evaluation, date in zip(evaluation_ids, evaluated)]
+
+        df_pending = df_records[is_pending]
+        logging.info(f'{len(df_pending)} of {len(df_records)} evaluation(s) are new or changed since the last export')
+        return df_pending
+
+    def mark_exported(self, df_records: pd.DataFrame) -> None:
+        '''
+            Stores the given evaluated records as exported, with the time they were evaluated.
+            Called only once the export of the window finished successfully.
+        '''
+        rows = zip(
+            df_records['evaluation.id'].astype(int),
+            df_records['recordId'].astype(int),
+            df_records['evaluation.evaluated'].astype(str),
+        )
+        exported = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        with self._lock:
+            self.connection.executemany('''
+                INSERT INTO evaluations (evaluationId, recordId, evaluated, exported) VALUES (?, ?, ?, ?)
+                ON CONFLICT(evaluationId) DO UPDATE SET
+                    recordId = excluded.recordId, evaluated = excluded.evaluated, exported = excluded.exported
+                ''', [(evaluation, record, evaluated, exported) for evaluation, record, evaluated in rows])
+            self.connection.commit()
+
+    def pending_schedules(self, schedules: list[tuple[int, str]]) -> list[tuple[int, str]]:
+        '''
+            Returns the (agentId, scheduleDate) pairs that were not exported yet.
+        '''
+        if len(schedules) == 0:
+            return list()
+
+        # Only the exported schedules of the dates asked for are read, not the whole history
+        dates = [date for _, date in schedules]
+        with self._lock:
+            exported = set(self.connection.execute(
+                'SELECT agentId, scheduleDate FROM schedules WHERE scheduleDate BETWEEN ? AND ?',
+                (min(dates), max(dates))).fetchall())
+
+        pending = [(int(agent), date) for agent, date in schedules if (int(agent), date) not in exported]
+        logging.info(f'{len(pending)} of {len(schedules)} schedule(s) are not exported yet')
+        return pending
+
+    def mark_schedules(self, schedules: list[tuple[int, str]]) -> None:
+        '''
+            Stores the (agentId, scheduleDate) pairs as exported.
+        '''
+        exported = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        with self._lock:
+            self.connection.executemany('''
+                INSERT OR REPLACE INTO schedules (agentId, scheduleDate, exported) VALUES (?, ?, ?)
+                ''', [(int(agent), date, exported) for agent, date in schedules])
+            self.connection.commit()
+
+    def changed_rows(self, table: str, df_rows: pd.DataFrame) -> tuple[pd.DataFrame, list[tuple[int, int]]]:
+        '''
+            Returns the rows of the table whose recordId was never exported, or whose content changed
+            since (see row_hashes), along with their (recordId, hash) to store with mark_rows once they
+            are exported. Rows reserved by another window count as exported, and the rows returned are
+            reserved until they are stored (mark_rows) or released (release_rows).
+        '''
+        if len(df_rows) == 0:
+            return df_rows, list()
+
+        hashes      = row_hashes(df_rows).tolist()
+        record_ids  = df_rows['recordId'].astype('int64').tolist()
+
+        with self._lock:
+            known   = self.__select_in('SELECT recordId, rowHash FROM exported_rows WHERE tableName = ? AND recordId IN ({})',
+                                       record_ids, table)
+
+            is_changed  = [self._reserved.get((table, record), known.get(record)) != row_hash
+                           for record, row_hash in zip(record_ids, hashes)]
+            rows        = [(record, row_hash) for record, row_hash, changed in zip(record_ids, hashes, is_changed) if changed]
+
+            self._reserved.update(((table, record), row_hash) for record, row_hash in rows)
+
+        return df_rows[is_changed], rows
+
+    def mark_rows(self, table: str, rows: list[tuple[int, int]]) -> None:
+        '''
+            Stores the (recordId, hash) of the rows of the table as exported, and ends their reservation.
+        '''
+        with self._lock:
+            self.connection.executemany('''
+                INSERT OR REPLACE INTO exported_rows (tableName, recordId, rowHash) VALUES (?, ?, ?)
+                ''', [(table, record, row_hash) for record, row_hash in rows])
+            self.connection.commit()
+
+            self.__end_reservation(table, rows)
+
+    def release_rows(self, table: str, rows: list[tuple[int, int]]) -> None:
+        '''
+            Ends the reservation of rows that could not be exported, other windows may write them again.
+        '''
+        with self._lock:
+            self.__end_reservation(table, rows)
+
+    def __end_reservation(self, table: str, rows: list[tuple[int, int]]) -> None:
+        # A row reserved again since (changed, by another window) keeps its reservation
+        for record, row_hash in rows:
+            if self._reserved.get((table, record)) == row_hash:
+                del self._reserved[(table, record)]
+
+    def __select_in(self, query: str, keys: list, *parameters) -> dict:
+        '''
+            Runs the query for the given keys, in chunks under the limit of variables of a statement,
+            and returns the (key, value) rows it selected as a dict. The query has a single {} where
+            the placeholders of the keys go, after the other parameters. Called holding the lock.
+        '''
+        selected = dict()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            selected.update(self.connection.execute(
+                query.format(','.join('?' * len(chunk))), [*parameters, *chunk]).fetchall())
+        return selected
+
+    def payload_hash(self, name: str) -> str:
+        '''
+            Returns the hash of the named payload (e.g. the evaluation forms) as of its last export.
+        '''
+        with self._lock:
+            row = self.connection.execute('SELECT hash FROM payloads WHERE name = ?', (name, )).fetchone()
+        return row[0] if row else None
+
+    def save_payload_hash(self, name: str, payload_hash: str) -> None:
+        '''
+            Stores the hash of the named payload, called once it was exported successfully.
+        '''
+        exported = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        with self._lock:
+            self.connection.execute('''
+                INSERT INTO payloads (name, hash, exported) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET hash = excluded.hash, exported = excluded.exported
+                ''', (name, payload_hash, exported))
+            self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,149 @@
+# External libraries
+import datetime as dt
+import json, re, threading
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+def endpoint_name(url: str) -> str:
+    '''
+        Reduces a URL to its endpoint, without host, query and identifiers:
+            https://.../api/rest/recording/contact/123/eval/456?x=1  ->  /recording/contact/{id}/eval/{id}
+    '''
+    path = re.sub(r'^\w+://[^/]+', '', url).split('?')[0]
+    path = path.split('/api/rest', 1)[-1]
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+class Metrics():
+    '''
+        Counters of the run, per API endpoint (requests, latency histogram, bytes received, retries)
+        and per table (rows normalized, rows and bytes written, files). Thread safe.
+        Written at the end of every window as a JSON report and as a Prometheus textfile.
+    '''
+
+    def __init__(self) -> None:
+        self._lock      = threading.Lock()
+        self._file_lock = threading.Lock()
+        self.started    = dt.datetime.now()
+        self.endpoints: dict[str, dict] = dict()
+        self.tables: dict[str, dict]    = dict()
+        self.windows: list[dict]        = list()
+
+    def __endpoint(self, url: str) -> dict:
+        return self.endpoints.setdefault(endpoint_name(url), dict(
+            requests=0, errors=0, retries=0, bytes_received=0, latency_sum=0.0,
+            latency_buckets=[0] * len(LATENCY_BUCKETS), status=dict()))
+
+    def __table(self, table: str) -> dict:
+        return self.tables.setdefault(table, dict(rows_normalized=0, rows_written=0, bytes_written=0, files=0))
+
+    def record_request(self, url: str, status: int, latency: float, bytes_received: int) -> None:
+        with self._lock:
+            endpoint = self.__endpoint(url)
+            endpoint['requests']        += 1
+            endpoint['bytes_received']  += bytes_received
+            endpoint['latency_sum']     += latency
+            endpoint['status'][str(status)] = endpoint['status'].get(str(status), 0) + 1
+
+            if status >= 400:
+                endpoint['errors'] += 1
+
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    endpoint['latency_buckets'][index] += 1
+                    break
+
+    def record_retry(self, url: str) -> None:
+        with self._lock:
+            self.__endpoint(url)['retries'] += 1
+
+    def record_rows(self, table: str, rows: int) -> None:
+        with self._lock:
+            self.__table(table)['rows_normalized'] += rows
+
+    def record_export(self, table: str, rows: int, bytes_written: int, files: int) -> None:
+        with self._lock:
+            counters = self.__table(table)
+            counters['rows_written']    += rows
+            counters['bytes_written']   += bytes_written
+            counters['files']           += files
+
+    def report(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(dict(
+                started     = self.started.strftime('%Y-%m-%d %H:%M:%S'),
+                updated     = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                latency_buckets = [str(bound) for bound in LATENCY_BUCKETS],
+                windows     = self.windows,
+                endpoints   = self.endpoints,
+                tables      = self.tables,
+            )))
+
+    def prometheus(self) -> str:
+        '''
+            Metrics in the Prometheus text exposition format.
+        '''
+        report  = self.report()
+        lines   = list()
+
+        def metric(name: str, kind: str, help: str, samples: list) -> None:
+            lines.append(f'# HELP calabrio_{name} {help}')
+            lines.append(f'# TYPE calabrio_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f'calabrio_{name}{{{label_text}}} {value}' if label_text else f'calabrio_{name} {value}')
+
+        endpoints = report['endpoints']
+
+        metric('requests_total', 'counter', 'API requests by endpoint and status.',
+               [(dict(endpoint=name, status=status), count)
+                for name, values in endpoints.items() for status, count in values['status'].items()])
+        metric('retries_total', 'counter', 'API requests retried, by endpoint.',
+               [(dict(endpoint=name), values['retries']) for name, values in endpoints.items()])
+        metric('response_bytes_total', 'counter', 'Bytes received from the API, by endpoint.',
+               [(dict(endpoint=name), values['bytes_received']) for name, values in endpoints.items()])
+
+        lines.append('# HELP calabrio_request_duration_seconds Latency of the API requests, by endpoint.')
+        lines.append('# TYPE calabrio_request_duration_seconds histogram')
+        for name, values in endpoints.items():
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, values['latency_buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'calabrio_request_duration_seconds_bucket{{endpoint="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'calabrio_request_duration_seconds_sum{{endpoint="{name}"}} {values["latency_sum"]}')
+            lines.append(f'calabrio_request_duration_seconds_count{{endpoint="{name}"}} {values["requests"]}')
+
+        tables = report['tables']
+        for key, help in [('rows_normalized', 'Rows normalized, by table.'),
+                          ('rows_written', 'Rows exported, by table.'),
+                          ('bytes_written', 'Bytes exported, by table.'),
+                          ('files', 'Files exported, by table.')]:
+            metric(f'{key}_total', 'counter', help, [(dict(table=name), values[key]) for name, values in tables.items()])
+
+        metric('windows_completed_total', 'counter', 'Extraction windows completed.', [(dict(), len(report['windows']))])
+
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_file: str, prometheus_file: str, start_date: dt.date, end_date: dt.date) -> None:
+        '''
+            Registers the window as completed and writes both reports, replacing the previous ones.
+        '''
+        with self._lock:
+            self.windows.append(dict(start=str(start_date), end=str(end_date),
+                                     completed=dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+        # Imported here, auxiliar imports the metrics of this module
+        from modules.auxiliar import write_file
+
+        with self._file_lock:
+            for filename, content in [(report_file, json.dumps(self.report(), indent=2)),
+                                      (prometheus_file, self.prometheus())]:
+                if not filename:
+                    continue
+
+                # Readers never see a partial report
+                write_file(filename, content)
+
+# Metrics of the current run, shared by every module
+metrics = Metrics()
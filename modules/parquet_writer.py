@@ -0,0 +1,250 @@
+# External libraries
+import datetime as dt
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.fs
+import pyarrow.parquet as pq
+
+class ParquetStreamWriter():
+    '''
+        Keeps one Parquet file open for a table and appends the batches written to it as row groups.
+        Batches are buffered until they add up to row_group_size rows, and written together as one row
+        group, whatever the size of each batch. Once the open file reaches the target size (or
+        max_file_rows rows) it is closed and the next row group starts a new one (part-00000.parquet,
+        part-00001.parquet, ...). A Parquet file is only readable once closed, so max_file_rows bounds
+        the rows lost when a run is interrupted.
+
+        The schema of a file is the union of the batches of its first row group (columns missing from a
+        batch are written as nulls). A later row group with columns the file lacks starts a new file,
+        whose schema adds them to the ones of the previous file.
+
+        With replace, files with the same prefix already in the folder are deleted when the writer opens.
+        on_file_completed, when given, is called with the name of every file once it is closed.
+
+        Works with local paths and object store URIs (e.g. s3://bucket/path) through pyarrow.fs.
+    '''
+
+    def __init__(self, base_path: str, compression: str = 'zstd', compression_level: int = None,
+                 target_file_size: int = 128 * 1024**2, row_group_size: int = 100_000,
+                 max_file_rows: int = None, file_prefix: str = 'part', replace: bool = True,
+                 on_file_completed = None) -> None:
+        self.compression        = compression
+        self.compression_level  = compression_level
+        self.target_file_size   = target_file_size
+        self.row_group_size     = row_group_size
+        self.max_file_rows      = max_file_rows
+        self.file_prefix        = file_prefix
+        self.on_file_completed  = on_file_completed
+
+        self.filesystem, self.base_path = pyarrow.fs.FileSystem.from_uri(base_path) \
+            if '://' in base_path else (pyarrow.fs.LocalFileSystem(), base_path)
+        self.filesystem.create_dir(self.base_path, recursive=True)
+
+        # Files of a previous (failed or repeated) export of the same partition are replaced
+        if replace:
+            for info in self.filesystem.get_file_info(pyarrow.fs.FileSelector(self.base_path)):
+                if info.base_name.startswith(f'{file_prefix}-') and info.base_name.endswith('.parquet'):
+                    self.filesystem.delete_file(info.path)
+
+        self.files: list[str]   = list()
+        self.rows_written       = 0
+        self.bytes_written      = 0
+
+        self._stream    = None
+        self._writer    = None
+        self._schema    = None
+        self._file_rows = 0
+
+        # Batches of the next row group
+        self._pending: list[pa.Table]   = list()
+        self._pending_rows              = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write(self, df: pd.DataFrame | pa.Table) -> None:
+        '''
+            Adds the dataframe (or Arrow table) to the next row group, which is written once it holds
+            row_group_size rows (or the rows left before max_file_rows).
+        '''
+        if len(df) == 0:
+            return
+
+        table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+
+        self._pending.append(self.__dictionary_indices(table))
+        self._pending_rows += len(table)
+
+        if self._pending_rows >= self.row_group_size or \
+                (self.max_file_rows is not None and self._file_rows + self._pending_rows >= self.max_file_rows):
+            self.__flush()
+
+    def close(self) -> None:
+        self.__flush()
+        self.__roll()
+
+    @staticmethod
+    def __dictionary_indices(table: pa.Table) -> pa.Table:
+        '''
+            Dictionary (categorical) columns are written as they are, so repeated strings are stored once
+            per row group. Their indices are widened to int32, as pandas picks the narrowest type for
+            each batch and batches with more categories could not be cast to the schema of the file.
+        '''
+        for index, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type) and field.type.index_type != pa.int32():
+                dictionary = pa.dictionary(pa.int32(), field.type.value_type, field.type.ordered)
+                table = table.set_column(index, field.with_type(dictionary), table.column(index).cast(dictionary))
+        return table
+
+    @staticmethod
+    def __conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+        '''
+            Aligns the table with the schema: missing columns are added as nulls and types are cast.
+            Returns None when the table has columns the schema lacks, or types that can't be cast.
+        '''
+        if schema is None or not set(table.column_names).issubset(schema.names):
+            return None
+
+        for field in schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field.name, pa.nulls(len(table), type=field.type))
+
+        try:
+            return table.select(schema.names).cast(schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return None
+
+    @staticmethod
+    def __union(schemas: list[pa.Schema]) -> pa.Schema:
+        '''
+            Returns the union of the columns of the schemas, or None when a column has different types.
+        '''
+        try:
+            return pa.unify_schemas(schemas)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return None
+
+    def __flush(self) -> None:
+        '''
+            Writes the buffered batches as one row group, under the union of their schemas. Batches whose
+            types can't be merged (e.g. a column of integers in one and text in the other) are written one
+            at a time instead.
+        '''
+        if len(self._pending) == 0:
+            return
+
+        tables, self._pending, self._pending_rows = self._pending, list(), 0
+
+        schema  = self.__union([table.schema for table in tables])
+        merged  = [self.__conform(table, schema) for table in tables]
+        if None not in merged:
+            tables = [pa.concat_tables(merged)]
+
+        for table in tables:
+            self.__write_row_group(table)
+
+    def __write_row_group(self, table: pa.Table) -> None:
+        if self._writer is not None:
+            conformed = self.__conform(table, self._schema)
+
+            # A row group that doesn't fit the open file (new columns, incompatible types) starts a new file,
+            # which keeps the columns of the previous one when it can
+            if conformed is None:
+                conformed = self.__conform(table, self.__union([self._schema, table.schema]))
+                self.__roll()
+
+            table = conformed if conformed is not None else table
+
+        if self._writer is None:
+            self.__open(table.schema)
+
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows_written   += len(table)
+        self._file_rows     += len(table)
+
+        if self._stream.tell() >= self.target_file_size or \
+                (self.max_file_rows is not None and self._file_rows >= self.max_file_rows):
+            self.__roll()
+
+    def __open(self, schema: pa.Schema) -> None:
+        file_name       = f'{self.base_path}/{self.file_prefix}-{str(len(self.files)).zfill(5)}.parquet'
+        self._stream    = self.filesystem.open_output_stream(file_name)
+        self._writer    = pq.ParquetWriter(
+            self._stream, schema, compression=self.compression, compression_level=self.compression_level)
+        self._schema    = schema
+        self._file_rows = 0
+        self.files.append(file_name)
+
+    def __roll(self) -> None:
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self.bytes_written += self._stream.tell()
+        self._stream.close()
+
+        logging.info(f'\tFile {self.files[-1]} completed')
+        self._writer, self._stream, self._schema = None, None, None
+
+        if self.on_file_completed is not None:
+            self.on_file_completed(self.files[-1])
+
+class PartitionedWriter():
+    '''
+        Splits every batch by the day of its event date column, and appends each part to the writer
+        of its partition, opened on first use with open_partition(day). Rows without an event date
+        (or tables without one) go to the partition of default_date.
+        Exposes the files, rows and bytes written across all partitions, as ParquetStreamWriter does.
+    '''
+
+    def __init__(self, open_partition, column: str = None, default_date: dt.date = None) -> None:
+        self.open_partition = open_partition
+        self.column         = column
+        self.default_date   = default_date
+        self.writers: dict[dt.date, ParquetStreamWriter] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @property
+    def files(self) -> list[str]:
+        return [file for writer in self.writers.values() for file in writer.files]
+
+    @property
+    def rows_written(self) -> int:
+        return sum(writer.rows_written for writer in self.writers.values())
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(writer.bytes_written for writer in self.writers.values())
+
+    def write(self, df: pd.DataFrame) -> None:
+        if len(df) == 0:
+            return
+
+        if self.column is None or self.column not in df.columns:
+            self.__writer(self.default_date).write(df)
+            return
+
+        days = pd.to_datetime(df[self.column], errors='coerce').dt.floor('D')
+        days = days.fillna(pd.Timestamp(self.default_date))
+
+        for day, part in df.groupby(days.values, sort=True):
+            self.__writer(pd.Timestamp(day).date()).write(part)
+
+    def close(self) -> None:
+        for writer in self.writers.values():
+            writer.close()
+
+    def __writer(self, day: dt.date) -> ParquetStreamWriter:
+        writer = self.writers.get(day)
+        if writer is None:
+            writer = self.writers[day] = self.open_partition(day)
+        return writer
@@ -0,0 +1,97 @@
+# External libraries
+import datetime as dt
+import logging, queue, threading
+import pandas as pd
+
+class ExportPipeline():
+    '''
+        Write stage of a window. The extractors fetch, decode and normalize their rows in batches and
+        put every batch here as soon as it is ready, a writer thread takes them from a bounded queue
+        and appends them to one open writer per table (see the open_writer of the sinks).
+
+        Only the batches in the queue (queue_size) and the row groups being written are held in memory,
+        whatever the size of the window. When the writer falls behind, put blocks, slowing the
+        extraction down instead of piling batches up.
+
+        With a state, the rows of the indexed tables (contacts) that were already exported unchanged
+        (or are being written by another window) are dropped before writing. The rows written are
+        reserved in the state at once and kept in exported_rows, to be stored in the state once the
+        window completes.
+    '''
+
+    # Tables checked against the index of exported rows of the state, by recordId
+    INDEXED_TABLES = ('df_all_records', 'df_eval_records')
+
+    def __init__(self, sink, bt: dt.datetime, queue_size: int = 8, state = None) -> None:
+        self.sink       = sink
+        self.bt         = bt
+        self.state      = state
+
+        self.exported_rows: dict[str, list[tuple[int, int]]] = dict()
+
+        self._queue     = queue.Queue(maxsize=queue_size)
+        self._writers   = dict()
+        self._results   = list()
+        self._error     = None
+
+        self._thread    = threading.Thread(target=self.__run, name=f'writer-{bt}', daemon=True)
+        self._thread.start()
+
+    def put(self, table: str, data: pd.DataFrame) -> None:
+        '''
+            Queues a batch of rows of the table for writing, blocking while the queue is full.
+            Raises the error of the writer, if it failed, so the extraction stops early.
+        '''
+        if self._error is not None:
+            raise self._error
+
+        if data is None or len(data) == 0:
+            return
+
+        self._queue.put((table, data))
+
+    def close(self) -> list:
+        '''
+            Writes the remaining batches and closes every writer. Returns what the sink returned
+            when closing each table (futures of the background uploads, or None).
+        '''
+        self._queue.put(None)
+        self._thread.join()
+
+        if self._error is not None:
+            raise self._error
+        return self._results
+
+    def __run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # Once failed, the batches are only drained so the producers are never blocked
+            if self._error is not None:
+                continue
+
+            table, data = item
+            try:
+                if self.state is not None and table in self.INDEXED_TABLES:
+                    data, rows = self.state.changed_rows(table, data)
+                    self.exported_rows.setdefault(table, list()).extend(rows)
+
+                    if len(data) == 0:
+                        continue
+
+                writer = self._writers.get(table)
+                if writer is None:
+                    writer = self._writers[table] = self.sink.open_writer(table, self.bt)
+                writer.write(data)
+            except Exception as e:
+                logging.exception(e)
+                self._error = e
+
+        for table, writer in self._writers.items():
+            try:
+                self._results.append(self.sink.close_writer(table, writer))
+            except Exception as e:
+                logging.exception(e)
+                self._error = self._error or e
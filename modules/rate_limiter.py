@@ -0,0 +1,69 @@
+# External libraries
+import logging, threading, time
+
+class RateLimiter():
+    '''
+        Adaptive token bucket shared by every thread using the API session.
+
+        Each request takes a token; tokens refill at the current rate (requests per second).
+        The rate adapts to the responses: it is halved on throttling (429) and reduced when the
+        latency goes above the target, then it grows back slowly while requests succeed.
+        A Retry-After sent by the server pauses every caller until it has elapsed.
+    '''
+
+    def __init__(self, rate: float = 20, min_rate: float = 1, max_rate: float = 50,
+                 latency_target: float = 5) -> None:
+        self.rate           = rate
+        self.min_rate       = min_rate
+        self.max_rate       = max_rate
+        self.latency_target = latency_target
+
+        self._lock          = threading.Lock()
+        self._tokens        = rate
+        self._updated       = time.monotonic()
+        self._paused_until  = 0.0
+
+    def acquire(self) -> None:
+        '''
+            Blocks until a request can be sent.
+        '''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                if now >= self._paused_until:
+                    # Refilling the bucket, at most one second worth of requests can be sent in a burst
+                    self._tokens    = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                    self._updated   = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+
+            time.sleep(wait)
+
+    def success(self, latency: float) -> None:
+        '''
+            Registers a successful response and its latency (seconds).
+        '''
+        with self._lock:
+            if latency > self.latency_target:
+                self.rate = max(self.min_rate, self.rate * 0.9)
+            else:
+                self.rate = min(self.max_rate, self.rate + 0.1)
+
+    def throttled(self, retry_after: float = None) -> None:
+        '''
+            Registers a throttled response (429), optionally with the seconds the server asked to wait.
+        '''
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+        logging.warning(f'Throttled by the API, rate lowered to {self.rate:.1f} request(s) per second')
@@ -0,0 +1,57 @@
+# Internal references
+from modules.auxiliar import write_file
+
+# External libraries
+import gzip, hashlib, os, re
+
+class ResponseCache():
+    '''
+        Content-addressed store of the raw API responses, kept on disk and compressed with gzip.
+
+        Bodies are stored once under the SHA-256 of their content (objects/), and each URL points
+        to the body it returned (urls/). URLs are keyed without their host, so a store recorded
+        against one tenant URL can be replayed with another.
+    '''
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+
+        os.makedirs(os.path.join(folder, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(folder, 'urls'), exist_ok=True)
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        return re.sub(r'^\w+://[^/]+', '', url)
+
+    def __path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.folder, kind, digest[:2], digest)
+
+    def __write(self, path: str, content: bytes) -> None:
+        # An interrupted run never leaves a partial entry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file(path, content)
+
+    def put(self, url: str, body: bytes) -> None:
+        content_digest  = hashlib.sha256(body).hexdigest()
+        object_path     = self.__path('objects', content_digest)
+
+        if not os.path.exists(object_path):
+            self.__write(object_path, gzip.compress(body, compresslevel=6))
+
+        url_digest = hashlib.sha256(self.url_key(url).encode('utf-8')).hexdigest()
+        self.__write(self.__path('urls', url_digest), content_digest.encode('utf-8'))
+
+    def get(self, url: str) -> bytes:
+        '''
+            Returns the body stored for the URL, or None when the URL was never recorded.
+        '''
+        url_digest  = hashlib.sha256(self.url_key(url).encode('utf-8')).hexdigest()
+        url_path    = self.__path('urls', url_digest)
+
+        if not os.path.exists(url_path):
+            return None
+
+        with open(url_path, 'rb') as f:
+            content_digest = f.read().decode('utf-8')
+        with open(self.__path('objects', content_digest), 'rb') as f:
+            return gzip.decompress(f.read())
@@ -0,0 +1,182 @@
+# External libraries
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dateutil.relativedelta import relativedelta
+import datetime as dt
+import json, logging, os, threading
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE    = 'done'
+FAILED  = 'failed'
+
+def plan_windows(min_date: dt.date, max_date: dt.date) -> list[tuple[dt.date, dt.date]]:
+    '''
+        Splits the period in windows: one per month, then one per day for the days left.
+        Each window starts where the previous one ended.
+    '''
+    relative_diff:relativedelta = relativedelta(max_date, min_date)
+
+    month_iters:int = (relative_diff.years*12) + relative_diff.months
+    day_iters:int   = relative_diff.days
+
+    windows = list()
+    date_min = min_date
+
+    while(month_iters!=0 or day_iters!=0):
+
+        if month_iters != 0:
+            date_diff = relativedelta(months=month_iters-1, days=day_iters)
+            month_iters = month_iters - 1
+        else:
+            date_diff = relativedelta(days=day_iters-1)
+            day_iters = day_iters - 1
+
+        date_max = max_date - date_diff
+        windows.append((date_min, date_max))
+
+        date_min = date_max
+
+    return windows
+
+class WindowScheduler():
+    '''
+        Runs the extraction windows of a backfill, several of them in parallel.
+
+        The status of every window (pending/running/done/failed) is kept in a checkpoint file, apart from
+        config.yaml. When restarted, windows already done are skipped and only the rest run again.
+        Without a checkpoint file every window runs, and nothing is kept.
+
+        Windows are planned again on every run, and their boundaries change as the period grows (the
+        daily windows of a month become a monthly window once it ends). A window counts as done when
+        its dates are covered by done windows, and plan starts after the done windows that cover the
+        start of the period. Adjacent done windows are merged in the checkpoint, so it holds a few
+        done periods and the windows left, instead of every window ever run.
+    '''
+
+    def __init__(self, checkpoint_file: str = None, parallel_windows: int = 1) -> None:
+        self.checkpoint_file    = checkpoint_file
+        self.parallel_windows   = parallel_windows
+
+        self._lock      = threading.Lock()
+        self.windows    = dict()
+
+        if checkpoint_file is not None and os.path.exists(checkpoint_file):
+            with open(checkpoint_file, 'r') as f:
+                self.windows = json.load(f)['windows']
+
+    def done_periods(self) -> list[tuple[str, str]]:
+        '''
+            Returns the (start, end) of the periods covered by done windows, merged and in order.
+        '''
+        periods = list()
+        for window in sorted((window for window in self.windows.values() if window['status'] == DONE),
+                             key=lambda window: window['start']):
+            if periods and window['start'] <= periods[-1][1]:
+                periods[-1] = (periods[-1][0], max(periods[-1][1], window['end']))
+            else:
+                periods.append((window['start'], window['end']))
+        return periods
+
+    def is_done(self, date_min: dt.date, date_max: dt.date) -> bool:
+        return any(start <= str(date_min) and str(date_max) <= end for start, end in self.done_periods())
+
+    def status(self, date_min: dt.date, date_max: dt.date) -> str:
+        if self.is_done(date_min, date_max):
+            return DONE
+        return self.windows.get(f'{date_min}_{date_max}', dict()).get('status', PENDING)
+
+    def resume_date(self, min_date: dt.date) -> dt.date:
+        '''
+            Returns the end of the done period that covers min_date, or min_date when none does.
+        '''
+        for start, end in self.done_periods():
+            if start <= str(min_date) <= end:
+                return max(min_date, dt.date.fromisoformat(end))
+        return min_date
+
+    def plan(self, min_date: dt.date, max_date: dt.date) -> list[tuple[dt.date, dt.date]]:
+        '''
+            Windows of the period (see plan_windows), from the first date not covered by done windows.
+        '''
+        return plan_windows(min(self.resume_date(min_date), max_date), max_date)
+
+    def run(self, windows: list[tuple[dt.date, dt.date]], run_window) -> bool:
+        '''
+            Runs every window not done yet with the given method, called as run_window(date_min, date_max).
+            Returns True when all windows are done.
+        '''
+        pending = list()
+
+        with self._lock:
+            for date_min, date_max in windows:
+                key = f'{date_min}_{date_max}'
+
+                if self.is_done(date_min, date_max):
+                    continue
+
+                self.windows[key] = dict(start=str(date_min), end=str(date_max), status=PENDING)
+                pending.append((key, date_min, date_max))
+
+            self.__save()
+
+        logging.info(f'{len(pending)} of {len(windows)} window(s) pending, running {self.parallel_windows} at a time')
+
+        with ThreadPoolExecutor(max_workers=self.parallel_windows) as executor:
+            futures = [executor.submit(self.__run_window, key, date_min, date_max, run_window)
+                       for key, date_min, date_max in pending]
+
+            results = [future.result() for future in as_completed(futures)]
+
+        return all(results)
+
+    def __run_window(self, key: str, date_min: dt.date, date_max: dt.date, run_window) -> bool:
+        self.__set_status(key, RUNNING)
+
+        try:
+            run_window(date_min, date_max)
+        except Exception as e:
+            logging.exception(e)
+            self.__set_status(key, FAILED)
+            return False
+
+        self.__set_status(key, DONE)
+        return True
+
+    def __set_status(self, key: str, status: str) -> None:
+        with self._lock:
+            self.windows[key]['status']     = status
+            self.windows[key]['updated']    = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.__save()
+
+    def __merge_done(self) -> None:
+        '''
+            Replaces the done windows by their merged periods, and drops the windows they cover
+            (failed or pending windows of a previous plan). Running windows are kept as they are.
+        '''
+        periods = self.done_periods()
+        updated = {period: '' for period in periods}
+
+        for key, window in list(self.windows.items()):
+            if window['status'] == RUNNING:
+                continue
+
+            period = next((period for period in periods
+                           if period[0] <= window['start'] and window['end'] <= period[1]), None)
+            if period is not None:
+                updated[period] = max(updated[period], window.get('updated', ''))
+                del self.windows[key]
+
+        for (start, end), last_update in updated.items():
+            self.windows[f'{start}_{end}'] = dict(start=start, end=end, status=DONE, updated=last_update)
+
+    def __save(self) -> None:
+        if self.checkpoint_file is None:
+            return
+
+        self.__merge_done()
+
+        # Imported here, plan reads the checkpoint without loading pandas
+        from modules.auxiliar import write_file
+
+        # The checkpoint is never left half written
+        write_file(self.checkpoint_file, json.dumps(dict(windows=self.windows), indent=2))
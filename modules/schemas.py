@@ -0,0 +1,153 @@
+# Internal references
+from modules.metrics import metrics
+
+# External libraries
+import logging
+import pandas as pd
+
+'''
+    Declared schema of every exported table, as {column: type}.
+    Types:
+        * timestamp - Epoch in milliseconds (as sent by the API), converted to datetime64
+        * date      - Date in text (YYYY-MM-DD), converted to datetime64
+        * integer   - Nullable integer (Int64), used for identifiers
+        * float     - float64
+        * category  - Repeated strings (names, texts of forms, metadata), stored once per distinct value
+                      in memory (pandas categorical) and written as dictionary columns to Parquet
+        * string    - Free text
+    Columns not listed keep the dtype inferred by json_normalize, listed columns that are missing
+    from a given extraction are ignored.
+'''
+
+_RECORDS = {
+    'recordId':                 'integer',
+    'startTime':                'timestamp',
+    'agent.name':               'category',
+    'metadata.queue':           'category',
+    'metadata.team':            'category',
+    'metadata.language':        'category',
+    'evaluation.id':            'integer',
+    'evaluation.evaluated':     'timestamp',
+    'evaluation.state':         'category',
+}
+
+SCHEMAS: dict[str, dict[str, str]] = {
+    'df_all_records':           _RECORDS,
+    'df_eval_records':          _RECORDS,
+
+    'df_eval_details': {
+        'evaluationId':         'integer',
+        'score':                'float',
+        'form.id':              'integer',
+        'form.name':            'category',
+        'evaluated':            'timestamp',
+    },
+    'df_eval_sections': {
+        'id':                   'integer',
+        'evaluationId':         'integer',
+        'name':                 'category',
+        'score':                'float',
+        'evaluated':            'timestamp',
+    },
+    'df_eval_questions': {
+        'questionId':           'integer',
+        'sectionId':            'integer',
+        'evaluationId':         'integer',
+        'text':                 'category',
+        'evaluated':            'timestamp',
+    },
+    'df_eval_comments': {
+        'commentId':            'integer',
+        'evaluationId':         'integer',
+        'created':              'timestamp',
+        'text':                 'string',
+        'evaluated':            'timestamp',
+    },
+
+    'df_forms': {
+        'formId':               'integer',
+        'name':                 'category',
+    },
+    'df_form_sections': {
+        'sectionId':            'integer',
+        'formId':               'integer',
+        'name':                 'category',
+    },
+    'df_form_questions': {
+        'questionId':           'integer',
+        'sectionId':            'integer',
+        'formId':               'integer',
+        'text':                 'category',
+    },
+    'df_form_options': {
+        'optionId':             'integer',
+        'questionId':           'integer',
+        'sectionId':            'integer',
+        'formId':               'integer',
+        'text':                 'category',
+    },
+
+    'df_agent_data': {
+        'agentId':              'integer',
+    },
+    'df_agent_schedules': {
+        'agentId':              'integer',
+        'scheduleDate':         'date',
+    },
+}
+
+# Column holding the date of the event of each row, tables are partitioned by it when exported.
+# Tables not listed (forms, agents) are partitioned by the start of their window.
+EVENT_DATES: dict[str, str] = {
+    'df_all_records':           'startTime',
+    'df_eval_records':          'evaluation.evaluated',
+    'df_eval_details':          'evaluated',
+    'df_eval_sections':         'evaluated',
+    'df_eval_questions':        'evaluated',
+    'df_eval_comments':         'evaluated',
+    'df_agent_schedules':       'scheduleDate',
+}
+
+def _to_number(column: pd.Series, dtype: str) -> pd.Series:
+    converted = pd.to_numeric(column, errors='coerce')
+
+    # Values that are not numeric are kept as they came, instead of losing them
+    if (converted.isna() & column.notna()).any():
+        logging.warning(f'Column {column.name} has non numeric values, it was not converted to {dtype}')
+        return column
+    return converted.astype(dtype)
+
+def _to_timestamp(column: pd.Series, unit: str = None) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    return pd.to_datetime(column, unit=unit, errors='coerce')
+
+_CONVERTERS = {
+    'timestamp':    lambda column: _to_timestamp(column, unit='ms'),
+    'date':         lambda column: _to_timestamp(column),
+    'integer':      lambda column: _to_number(column, 'Int64'),
+    'float':        lambda column: _to_number(column, 'float64'),
+    'category':     lambda column: column.astype('category'),
+    'string':       lambda column: column.astype('string'),
+}
+
+def apply_schema(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    '''
+        Converts the columns of the dataframe to the types declared for the table.
+        Every conversion works on the whole column at once.
+            Args:
+                df      - Dataframe as extracted (e.g. from json_normalize)
+                table   - Name of the table, as in SCHEMAS (the df_ attribute name)
+    '''
+    schema = SCHEMAS.get(table, dict())
+    metrics.record_rows(table, len(df))
+
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        try:
+            df[column] = _CONVERTERS[kind](df[column])
+        except (TypeError, ValueError) as e:
+            logging.warning(f'Column {column} of {table} could not be converted to {kind}: {e}')
+
+    return df